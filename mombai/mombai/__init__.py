@@ -1,12 +1,35 @@
-from mombai._decorators import getargspec, getargs, cache, decorate, try_value, try_back, try_nan, try_none, try_zero, try_str, try_list, try_dict, relabel, support_kwargs, profile
-from mombai._decorators import Hash, callattr, callitem, list_loop, dict_loop, NoneType, pool
-from mombai._containers import is_array, as_array, as_ndarray, as_list, as_str, as_type, replace, ordered_set, slist, args_len, args_zip, args_to_list, args_to_dict, concat, many2one
-from mombai._compare import eq, cmp, Cmp, Sort
-from mombai._dict_utils import dict_zip, dict_concat, dict_append, dict_merge, dict_invert, dict_apply, data_and_columns_to_dict, pass_thru, first, last
-from mombai._dict_utils import items_to_tree, tree_items, tree_to_dicts
-from mombai._dict import Dict
-from mombai._dictable import Dictable, cartesian
-from mombai._periods import day, week, month, bday, Month, BusinessDay, is_weekend, is_eom
-from mombai._dates import dt, today, as_mm
-from mombai._cell import Cell, MemCell, EODCell, Const, HDFCell
-from mombai._graph import DAG, XCL
+"""
+The public names of mombai are loaded lazily (PEP 562): a submodule, and the dependencies it pulls in (pandas, h5py, networkx, tinydb...),
+is only imported when one of its names is first used. So 'from mombai import dt' does not import networkx.
+"""
+import importlib
+
+_exports = {
+    'mombai._decorators' : ['getargspec', 'getargs', 'cache', 'Cache', 'DiskCache', 'decorate', 'try_value', 'try_back', 'try_nan', 'try_none', 'try_zero', 'try_str', 'try_list', 'try_dict', 'relabel', 'support_kwargs', 'profile',
+                            'Hash', 'callattr', 'callitem', 'list_loop', 'dict_loop', 'NoneType'],
+    'mombai._containers' : ['is_array', 'as_array', 'as_ndarray', 'as_list', 'as_str', 'as_type', 'replace', 'ordered_set', 'slist', 'args_len', 'args_zip', 'args_to_list', 'args_to_dict', 'concat', 'many2one'],
+    'mombai._compare' : ['eq', 'cmp', 'Cmp', 'Sort', 'sort_key'],
+    'mombai._dict_utils' : ['dict_zip', 'dict_concat', 'dict_append', 'dict_merge', 'dict_invert', 'dict_apply', 'data_and_columns_to_dict', 'pass_thru', 'first', 'last',
+                            'items_to_tree', 'tree_items', 'tree_to_dicts', 'tree_to_columns', 'iter_tree_items', 'tree_file_to_columns'],
+    'mombai._dict' : ['Dict'],
+    'mombai._dictable' : ['Dictable', 'cartesian', 'cartesian_pairs'],
+    'mombai._periods' : ['day', 'week', 'month', 'bday', 'Month', 'BusinessDay', 'Calendar', 'schedule', 'is_weekend', 'is_eom'],
+    'mombai._dates' : ['dt', 'today', 'as_mm'],
+    'mombai._cell' : ['Cell', 'MemCell', 'EODCell', 'Const', 'HDFCell'],
+    'mombai._graph' : ['DAG', 'XCL'],
+}
+
+_modules = {name : module for module, names in _exports.items() for name in names}
+
+__all__ = list(_modules)
+
+def __getattr__(name):
+    module = _modules.get(name)
+    if module is None:
+        raise AttributeError('module %r has no attribute %r'%(__name__, name))
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
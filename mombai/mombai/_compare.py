@@ -1,7 +1,7 @@
 import numpy as np
-import pandas as pd
+import heapq
 from mombai._decorators import cache
-from mombai._containers import as_ndarray, as_list
+from mombai._containers import as_ndarray, as_list, _pandas_types
 
 def _eq_attrs(x, y, attrs):
     for attr in attrs:
@@ -10,6 +10,40 @@ def _eq_attrs(x, y, attrs):
     return True
 
 
+def _first(item):
+    return item[0]
+
+_numeric_kinds = 'biufc'
+
+def _eq_arrays(x, y):
+    """
+    compares two np.ndarray of the same shape. Typed arrays are compared natively, treating nan (and NaT) as equal. 
+    Only object arrays are compared element by element
+    """
+    if x.size == 0:
+        return True
+    kx, ky = x.dtype.kind, y.dtype.kind
+    if kx == 'O' or ky == 'O':
+        return all(map(eq, x.ravel(), y.ravel()))
+    elif kx in _numeric_kinds and ky in _numeric_kinds:
+        return bool(np.array_equal(x, y, equal_nan = kx in 'fc' or ky in 'fc'))
+    elif kx == ky and kx in 'mM':
+        return bool(np.array_equal(x, y, equal_nan = True))
+    elif kx == ky and kx in 'US':
+        return bool(np.all(x == y))
+    else:
+        return False
+
+_arrays = (np.ndarray, list, tuple)
+
+def _eq_value(x, y):
+    """
+    dict values that are arrays of different types (e.g. a tuple and an np.ndarray) are compared item by item
+    """
+    if isinstance(x, _arrays) and isinstance(y, _arrays) and type(x) != type(y):
+        return len(x) == len(y) and all(map(eq, x, y))
+    return eq(x, y)
+
 def eq(x, y):
     """
     A better nan-handling equality comparison. Here is the problem:
@@ -54,17 +88,19 @@ def eq(x, y):
     """
     if x is y:
         return True
-    elif isinstance(x, (np.ndarray, tuple, list)):
-        return type(x)==type(y) and len(x)==len(y) and _eq_attrs(x,y, ['__shape__']) and np.all(veq(x,y))
-    elif isinstance(x, (pd.Series, pd.DataFrame)):
-        return type(x)==type(y) and _eq_attrs(x,y, attrs = ['__shape__', 'index', 'columns']) and np.all(veq(x,y))
+    elif isinstance(x, np.ndarray):
+        return type(x)==type(y) and x.shape == y.shape and _eq_arrays(x, y)
+    elif isinstance(x, (tuple, list)):
+        return type(x)==type(y) and len(x)==len(y) and all(map(eq, x, y))
+    elif isinstance(x, _pandas_types('Series', 'DataFrame')):
+        return type(x)==type(y) and _eq_attrs(x,y, attrs = ['shape', 'index', 'columns']) and eq(x.to_numpy(), y.to_numpy())
     elif isinstance(x, dict):
         if type(x) == type(y) and len(x)==len(y):
             if len(x) == 0:
                 return True
-            xkey, xval = zip(*sorted(x.items()))
-            ykey, yval = zip(*sorted(y.items()))
-            return eq(xkey, ykey) and eq(np.array(xval, dtype='object'), np.array(yval, dtype='object'))
+            xkey, xval = zip(*sorted(x.items(), key = _first))
+            ykey, yval = zip(*sorted(y.items(), key = _first))
+            return eq(xkey, ykey) and all(map(_eq_value, xval, yval))
         else:
             return False
     elif isinstance(x, float) and np.isnan(x):
@@ -82,17 +118,17 @@ def _cmparr(*arr):
     """
     compare arrays, each of arr is a list of pairs. We stop the moment we have a non zero value
     """
-    c = 0
     for a in arr:
         for pair in a:
             c  = cmp(*pair)
             if c!=0:
-                break
-    return c
+                return c
+    return 0
 
+_numbers = (int, float, np.int64, np.int32, np.int16)
 
 def _type(x):
-    return str(float if isinstance(x, (int,float, np.int64, np.int32, np.int, np.int16)) else type(x))
+    return str(float if isinstance(x, _numbers) else type(x))
 
 def _len(x):
     return len(x) if hasattr(x, '__len__') else 0
@@ -133,8 +169,8 @@ def cmp(x, y):
     """
     if x is y:
         return 0
-    tx = str(float if isinstance(x, (int,float, np.int64, np.int32, np.int, np.int16)) else type(x))
-    ty = str(float if isinstance(y, (int,float, np.int64, np.int32, np.int, np.int16)) else type(y))
+    tx = _type(x)
+    ty = _type(y)
     if tx<ty:
         return -1
     elif tx>ty:
@@ -190,6 +226,58 @@ class Cmp(object):
 
 vCmp = np.vectorize(Cmp)
 
+_type_ranks = {}
+
+def _type_rank(x):
+    tp = type(x)
+    rank = _type_ranks.get(tp)
+    if rank is None:
+        rank = _type_ranks[tp] = _type(x)
+    return rank
+
+def sort_key(x):
+    """
+    maps a value, once, to a key that sorts natively in the same order as cmp:
+    first on type, then nan-last numbers, then arrays by length and then element-wise, dicts by length, keys and then values.
+
+    >>> from numpy import nan
+    >>> values = [1, 'a', None, nan, 0.5, [1,2], [0,1,2], (1,), {'a': 1}]
+    >>> assert sorted(values, key = sort_key) == sorted(values, key = Cmp)
+    >>> assert sort_key(1) == sort_key(1.0)
+    >>> assert sort_key([1, nan]) > sort_key([1, 2])
+    """
+    rank = _type_rank(x)
+    if isinstance(x, (np.ndarray, tuple, list)):
+        return (rank, len(x), tuple(map(sort_key, x)))
+    elif isinstance(x, dict):
+        items = sorted(x.items(), key = lambda item: sort_key(item[0]))
+        return (rank, len(x), tuple(sort_key(k) for k, _ in items), tuple(sort_key(v) for _, v in items))
+    elif isinstance(x, float) and np.isnan(x):
+        return (rank, np.inf)
+    else:
+        return (rank, x)
+
+def _ranks(value):
+    """
+    converts an object array into integer ranks using sort_key, so that np.lexsort compares ints rather than Cmp objects.
+    values whose keys cannot be compared natively fall back to Cmp
+    """
+    keys = [sort_key(v) for v in value]
+    try:
+        order = sorted(range(len(keys)), key = keys.__getitem__)
+        ranks = np.empty(len(keys), dtype = int)
+        rank = 0
+        prev = None
+        for i in order:
+            key = keys[i]
+            if prev is not None and key != prev:
+                rank += 1
+            ranks[i] = rank
+            prev = key
+        return ranks
+    except (TypeError, ValueError):
+        return vCmp(value)
+
 def as_1d_arrays(values):
     """
     if the user provided a columns of same-size np.arrays, we split it into its constituents
@@ -210,9 +298,39 @@ def as_1d_arrays(values):
 
 def as_cmp(values) :
     return [vCmp(value) if value.dtype == np.dtype('O') else value for value in values]
+
+def _changes(key):
+    """
+    True where a sorted key differs from the one before it. nan/NaT are equal to each other
+    >>> assert list(_changes(np.array([1., 1., 2., np.nan, np.nan]))) == [False, True, True, False]
+    """
+    changes = key[1:] != key[:-1]
+    if key.dtype.kind in 'fcmM':
+        nan = np.isnat(key) if key.dtype.kind in 'mM' else np.isnan(key)
+        changes &= ~(nan[1:] & nan[:-1])
+    return changes
+
+def as_sort_key(values):
+    return [_ranks(value) if value.dtype == np.dtype('O') else value for value in values]
     
 
+def _descending(value):
+    """
+    returns key columns, most significant first, that sort natively in reverse order to value. nan/NaT, sorted last when ascending, come first.
+    """
+    kind = value.dtype.kind
+    if kind in 'biu':
+        return [~value]
+    elif kind == 'f':
+        return [~np.isnan(value), -value]
+    elif kind in 'mM':
+        return [~np.isnat(value), ~value.view('i8')]
+    else:
+        _, inverse = np.unique(value, return_inverse = True)
+        return [-inverse]
+
 def panda_sorter(values):
+    import pandas as pd
     cols= list(range(len(values)))
     return pd.DataFrame(data = np.array(values).T, columns = cols).sort_values(by = cols).index.values
 
@@ -225,6 +343,7 @@ class Sort(object):
     :values are provided as lists
     :key is used to transform the values into comparable keys
     :sorter: The sorting itself is done using self.sorter. This is np.lexsort by default, can use panda_sorter as an alternative
+    :ascending: a bool or a list of bools, one per value. Descending values have their keys reversed natively, so typed columns stay typed.
 
     self.keys is then what is actually sorted and compared, derived as self.key applied to self.values
     self.argsort is what produces the indexing, applied to self.keys
@@ -233,21 +352,39 @@ class Sort(object):
     
     self.grouped uses the actual values to return a list of lists, each element has the same original value.
     """
-    def __init__(self, values, sorter=np.lexsort, transform=None, key = [as_1d_arrays, as_cmp]):
+    def __init__(self, values, sorter=np.lexsort, transform=None, key = [as_1d_arrays, as_sort_key], ascending = True):
         self.values = tuple(as_ndarray(v) for v in values)
         if transform: 
             self.values = tuple(transform(v) for v in self.values)
         self.sorter = sorter
         self.transform = transform
         self.key = key
+        if isinstance(ascending, (list, tuple)):
+            if len(ascending) != len(self.values):
+                raise ValueError('ascending has %i values but there are %i keys to sort by'%(len(ascending), len(self.values)))
+            self.ascending = [bool(a) for a in ascending]
+        else:
+            self.ascending = [bool(ascending)] * len(self.values)
     
+    def _keys(self, values):
+        for k in as_list(self.key):
+            values = k(values)
+        return values
+
     @property
     @cache
     def keys(self):
-        values = self.values
-        for k in as_list(self.key):
-            values = k(values)
-        return values[::-1]
+        if min(self.ascending, default = True):
+            return self._keys(self.values)[::-1]
+        keys = []
+        for value, ascending in zip(self.values, self.ascending):
+            values = self._keys([value])
+            if ascending:
+                keys.extend(values)
+            else:
+                for v in values:
+                    keys.extend(_descending(v))
+        return keys[::-1]
 
     @property
     @cache
@@ -275,6 +412,56 @@ class Sort(object):
         elif isinstance(values, dict):
             return type(values)({key: self.sort(value) for key, value in values.items()})
     
+    def top(self, n, largest = False):
+        """
+        returns the indices of the first n values in sort order, or, if largest, of the last n values, largest first, without sorting all values.
+        Ties are kept in their original order.
+        Typed keys are narrowed down using np.argpartition on the primary key, object keys are selected using a heap over sort_key.
+
+        >>> s = Sort([[3,1,2,1,5]])
+        >>> assert list(s.top(2)) == [1,3]
+        >>> assert list(s.top(2, largest = True)) == [4,0]
+        """
+        n = max(int(n), 0)
+        if n == 0:
+            return np.array([], dtype = int)
+        if self.sorter is not np.lexsort or as_list(self.key) != [as_1d_arrays, as_sort_key] or not min(self.ascending, default = True):
+            return self._top_sorted(n, largest)
+        values = as_1d_arrays(self.values)
+        size = len(values[0])
+        if n >= size:
+            return self._top_sorted(n, largest)
+        if min(value.dtype != np.dtype('O') for value in values):
+            primary = values[0]
+            kth = size - n if largest else n - 1
+            bound = primary[np.argpartition(primary, kth)[kth]]
+            candidates = np.flatnonzero(~(primary < bound) if largest else ~(primary > bound)) ## nan is sorted last so is never excluded
+            keys = [value[candidates] for value in values[::-1]]
+            if largest:
+                order = np.lexsort([-candidates] + keys)[::-1]
+            else:
+                order = np.lexsort(keys)
+            return candidates[order[:n]]
+        keys = [list(map(sort_key, value)) for value in values]
+        select = heapq.nlargest if largest else heapq.nsmallest
+        try:
+            return np.array(select(n, range(size), key = lambda i: tuple(key[i] for key in keys)), dtype = int)
+        except (TypeError, ValueError):
+            return self._top_sorted(n, largest)
+
+    def _top_sorted(self, n, largest = False):
+        """
+        top by a full sort. For largest, the sorted rows are ranked by their keys and the ranks reversed, so ties stay in their original order
+        """
+        argsort = np.asarray(self.argsort, dtype = int)
+        if not largest or len(argsort) < 2:
+            return argsort[:n]
+        changes = np.zeros(len(argsort) - 1, dtype = bool)
+        for key in self.keys:
+            changes |= _changes(np.asarray(key)[argsort])
+        ranks = np.concatenate([[0], np.cumsum(changes)])
+        return argsort[np.argsort(-ranks, kind = 'stable')][:n]
+
     def __len__(self):
         return len(self.keys[0])
     
@@ -1,9 +1,11 @@
 from ordered_set import OrderedSet
 import numpy as np
-import pandas as pd
 from mombai._decorators import try_false
 from _collections_abc import dict_keys, dict_values
 from copy import copy
+from operator import is_
+from itertools import repeat
+import array
 import sys
 version = sys.version_info
 
@@ -110,11 +112,63 @@ def as_array(value):
     else:
         return [value]
 
-def as_ndarray(value):
+_array_types = (array.array, memoryview)
+
+_pandas_memo = {}
+
+def _pandas_types(*names):
+    """
+    The named pandas classes, or () if pandas was never imported: nothing can be a pandas object before pandas is imported, 
+    so isinstance checks do not need to import pandas. Once pandas is imported, the tuple is built once and memoised.
+    >>> import pandas as pd
+    >>> assert _pandas_types('Series', 'Index') == (pd.Series, pd.Index)
+    """
+    res = _pandas_memo.get(names)
+    if res is None:
+        pd = sys.modules.get('pandas')
+        if pd is None:
+            return ()
+        res = _pandas_memo[names] = tuple(getattr(pd, name) for name in names)
+    return res
+
+def _is_single_type(values):
+    """
+    a single pass over values, stopping at the first item whose type differs from the type of the first item
+    >>> assert _is_single_type([1,2,3])
+    >>> assert not _is_single_type([1,'a',3])
+    >>> assert not _is_single_type([])
+    """
+    if len(values) == 0:
+        return False
+    return all(map(is_, map(type, values), repeat(type(values[0]))))
+
+def as_ndarray(value, dtype = None):
+    """
+    converts value into a np.ndarray. Values of a single type are converted by numpy, mixed types are kept as an object array.
+    If dtype is provided, we trust the user and skip the type scan.
+    >>> assert as_ndarray([1,2]).dtype == int
+    >>> assert as_ndarray([1,2.]).dtype == object
+    >>> assert as_ndarray([1,2], dtype = float).dtype == float
+    >>> assert list(as_ndarray(range(1,7,2))) == [1,3,5]
+    >>> import pandas as pd
+    >>> assert list(as_ndarray(pd.Series([1,2]))) == [1,2]
+    >>> assert as_ndarray(pd.Series(['x', 'y'])).dtype == as_ndarray(['x', 'y']).dtype
+    """
     if isinstance(value, np.ndarray):
-        return value
-    value = as_list(value, nplist)
-    if len(set([type(v) for v in value]))==1:
+        return value if dtype is None else value.astype(dtype, copy = False)
+    elif isinstance(value, range) and len(value) and dtype is None:
+        return np.arange(value.start, value.stop, value.step)
+    elif isinstance(value, _pandas_types('Series', 'Index')):
+        if dtype is not None or value.dtype.kind != 'O':
+            return value.to_numpy(dtype = dtype)
+        value = value.tolist() ## object/string columns get the same type scan as lists
+    elif isinstance(value, (array.array, memoryview)):
+        return np.asarray(value, dtype = dtype)
+    if not isinstance(value, (list, tuple)):
+        value = as_list(value, nplist)
+    if dtype is not None:
+        return np.array(value, dtype = dtype)
+    if _is_single_type(value):
         try:
             return np.array(value)
         except Exception:
@@ -122,8 +176,7 @@ def as_ndarray(value):
     try:
         return np.array(value, dtype='object')
     except Exception:
-        return value
-    raise Exception('could not construct %s as an array' % value)
+        return value if isinstance(value, nplist) else nplist(value)
 
 def as_type(value):
     return value if isinstance(value, type) else type(value)
@@ -135,24 +188,39 @@ def as_str(value, max_rows = None, max_chars = None):
     else:
         return '\n'.join([row[:max_chars] for row in value.__str__().split('\n')[:max_rows]])
 
-def _args_len(*values):
-    lens = slist([len(value) for value in values]) - 1
+def _lens_to_len(lens):
+    lens = slist(lens) - 1
     if len(lens)>1:
         raise ValueError('all values must have same length')
     return lens[0] if lens else 1
+
+def _args_len(*values):
+    return _lens_to_len([len(value) for value in values])
     
+def _array_len(value):
+    """
+    the length of as_ndarray(value), without actually converting value
+    """
+    if value is None:
+        return 0
+    elif is_array(value) or isinstance(value, _array_types + _pandas_types('Series', 'Index')):
+        return len(value)
+    else:
+        return 1
+
 def args_len(*values):
-    return _args_len(*[as_ndarray(value) for value in values])
+    return _lens_to_len([_array_len(value) for value in values])
     
 def args_zip(*values):
     """
     This function is a safer version of zipping. 
-    We insist that all elements have size 1 or the same length
+    We insist that all elements have size 1 or the same length. 
+    Arrays are read directly (no copying into lists) and size 1 elements are broadcast without copying.
+    >>> assert list(args_zip(np.array([1,2]), 'a', [3,4])) == [(1, 'a', 3), (2, 'a', 4)]
     """
-    values = [as_list(value) for value in values]
+    values = [list(value) if isinstance(value, dict_keys) else as_array(value) for value in values]
     n = _args_len(*values)
-    values = [value*n if len(value)!=n else value for value in values]
-    return zip(*values)
+    return zip(*[repeat(value[0], n) if len(value)!=n else value for value in values])
 
 def args_to_list(args):
     """
@@ -192,9 +260,27 @@ def args_to_dict(args):
     return res
 
 
+def _is_bool_mask(item, n = None):
+    """
+    decides if item is a boolean mask rather than an index. 
+    For np.ndarray we use the dtype: a bool array is a mask, any other typed array is an index. Only lists and object arrays are scanned.
+    >>> assert _is_bool_mask(np.array([True, False]))
+    >>> assert not _is_bool_mask(np.array([0, 1]))
+    >>> assert _is_bool_mask([True, 0, 1])
+    >>> assert not _is_bool_mask([True, False], n = 3)
+    """
+    if isinstance(item, (str, range)) or not hasattr(item, '__len__') or (n is not None and len(item) != n):
+        return False
+    if isinstance(item, np.ndarray):
+        if item.dtype == bool:
+            return True
+        elif item.dtype != object:
+            return False
+    return len(item) > 0 and all(isinstance(i, (bool, np.bool_)) or i in (0,1) for i in item)
+
 def _getitem_as_array(iterable, item, check_bool = True):
     if is_array(item):
-        if check_bool and len(item) == len(iterable) and min([isinstance(i, bool) or i in [0,1] for i in item]):
+        if check_bool and _is_bool_mask(item, len(iterable)):
             return [i for i, tf in zip(iterable, item) if tf]
         else:
             return [iterable[i] for i in item]
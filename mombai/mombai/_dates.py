@@ -1,8 +1,9 @@
 import datetime
 from dateutil import parser
-from mombai._periods import _ymd2dt, day, Month, BusinessDay
+from mombai._periods import _ymd2dt, _ymd2dt_array, day, Month, BusinessDay
 import numpy as np
-from functools import reduce
+from functools import reduce, partial
+import string
 from operator import __add__
 from functools import singledispatch
 from  mombai._decorators import getargspec
@@ -55,6 +56,67 @@ def _int2dt(arg=0):
         return datetime.datetime.utcfromtimestamp(arg)
 
 
+_SHAPE = str.maketrans(string.digits + string.ascii_letters, '9' * len(string.digits) + 'a' * len(string.ascii_letters))
+_STRPTIME_FORMATS = ['%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M:%S.%f', 
+                     '%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M', '%Y/%m/%d %H:%M:%S', '%Y/%m/%d %H:%M',
+                     '%d %b %Y', '%d-%b-%Y', '%d%b%Y', '%d %B %Y', '%d-%B-%Y', '%b %d %Y', '%B %d %Y', '%b %d, %Y', '%B %d, %Y',
+                     '%d %b %Y %H:%M:%S', '%d-%b-%Y %H:%M:%S', '%a %b %d %H:%M:%S %Y']
+_MAX_SHAPES = 1024
+_str_parsers = {}
+
+def _str_shape(arg):
+    """
+    The shape of a date string: digits are replaced by 9 and letters by a
+    >>> assert _str_shape('01/09/2001') == '99/99/9999'
+    >>> assert _str_shape('1st Sep 2001') == '9aa aaa 9999'
+    """
+    return arg.translate(_SHAPE)
+
+def _ymd_slices(shape):
+    """
+    If strings of this shape split into three groups of digits (on ' ', '-' or '/', in that order), returns the slices of the groups.
+    >>> assert _ymd_slices('99/99/9999') == (slice(0,2), slice(3,5), slice(6,10))
+    >>> assert _ymd_slices('9999-99-99 99:99') is None
+    """
+    for txt in [' ', '-', '/']:
+        parts = shape.split(txt)
+        if len(parts) == 3 and min([len(part)>0 and part == '9' * len(part) for part in parts]):
+            slices = []
+            i = 0
+            for part in parts:
+                slices.append(slice(i, i + len(part)))
+                i += len(part) + 1
+            return tuple(slices)
+    return None
+
+def _slice_parse(slices, arg):
+    args = [int(arg[s]) for s in slices]
+    if args[0]>50:
+        return _ymd2dt(*args)
+    elif args[-1]>50:
+        return _ymd2dt(*args[::-1])
+    return parser.parse(arg)
+
+def _strptime_parse(fmt, arg):
+    try:
+        return datetime.datetime.strptime(arg, fmt)
+    except ValueError:
+        return parser.parse(arg)
+
+def _strptime_format(arg, date):
+    """
+    finds a strptime format that reproduces the date dateutil parsed from arg, or None
+    >>> assert _strptime_format('2001-09-01T06:00:00', datetime.datetime(2001,9,1,6)) == '%Y-%m-%dT%H:%M:%S'
+    >>> assert _strptime_format('1st Sep 2001', datetime.datetime(2001,9,1)) is None
+    """
+    for fmt in _STRPTIME_FORMATS:
+        try:
+            if datetime.datetime.strptime(arg, fmt) == date:
+                return fmt
+        except ValueError:
+            pass
+    return None
+
 def _str2dt(arg):
     """
     The parser has an American tendencies so we check the two formats
@@ -67,18 +129,30 @@ def _str2dt(arg):
     >>> assert _str2dt('20010901') == D(2001,9,1)
     >>> assert _str2dt('2001 Sep 1st') == D(2001,9,1)
     >>> assert _str2dt('1st Sep 2001') == D(2001,9,1)
+    
+    Files almost always use a single format, so the parser is cached by the shape of the string (see _str_shape).
+    The first string of a shape decides: three groups of digits get a fixed-slice parser applying the UK preference, 
+    otherwise dateutil parses it and, if one of _STRPTIME_FORMATS reproduces the result, later strings use strptime.
+    >>> assert _str2dt('2001-09-01 06:30') == D(2001,9,1,6,30)
+    >>> assert _str2dt('2002-10-02 07:31') == D(2002,10,2,7,31) ## using '%Y-%m-%d %H:%M'
     """
     if arg.isdigit():
         return _int2dt(int(arg))
-    for txt in [' ', '-', '/']:
-        args = arg.split(txt)
-        if len(args) == 3 and min([a.isdigit() for a in args]):
-            args = [int(a) for a in args]
-            if args[0]>50:
-                return _ymd2dt(*args)
-            elif args[-1]>50:
-                return _ymd2dt(*args[::-1])
-    return parser.parse(arg)
+    shape = _str_shape(arg)
+    parse = _str_parsers.get(shape)
+    if parse is not None:
+        return parse(arg)
+    slices = _ymd_slices(shape)
+    if slices is not None:
+        parse = partial(_slice_parse, slices)
+        res = parse(arg)
+    else:
+        res = parser.parse(arg)
+        fmt = _strptime_format(arg, res)
+        parse = parser.parse if fmt is None else partial(_strptime_parse, fmt)
+    if len(_str_parsers) < _MAX_SHAPES:
+        _str_parsers[shape] = parse
+    return res
 
 def dt(*args):
     """
@@ -141,6 +215,170 @@ def dt(*args):
             return _int2dt(int(arg)) + datetime.timedelta(float(arg) % 1)
 
 
+_NaT = np.datetime64('NaT', 'us')
+_EXCEL0 = np.datetime64('1899-12-30', 'D')
+_ORDINAL0 = np.datetime64('0001-01-01', 'D')
+_NS_MIN = np.datetime64('1677-09-22', 'us')
+_NS_MAX = np.datetime64('2262-04-11', 'us')
+_SEPARATORS = [ord(c) for c in ' -/']
+_ISO_TIME = [ord(c) for c in '0123456789:.']
+
+def _int2dt_vector(arg):
+    """
+    vectorised _int2dt: classifies integers by the same ranges and converts each range in bulk.
+    returns a datetime64[us] array
+    """
+    arg = np.asarray(arg, dtype = np.int64)
+    res = np.empty(arg.shape, 'datetime64[us]')
+    rel = arg<=1500
+    res[rel] = np.datetime64(today(), 'D') + arg[rel]
+    year = ~rel & (arg<=3000)
+    res[year] = (arg[year] - 1970).astype('datetime64[Y]')
+    excel = (arg>3000) & (arg<300000)
+    res[excel] = _EXCEL0 + arg[excel]
+    ordinal = (arg>=300000) & (arg<1095000)
+    res[ordinal] = _ORDINAL0 + (arg[ordinal] - 1)
+    ymd = (arg>=10000101) & (arg<=30001231)
+    y, md = np.divmod(arg[ymd], 10000)
+    m, d = np.divmod(md, 100)
+    res[ymd] = _ymd2dt_array(y, m, d)
+    stamp = ~(rel | year | excel | ordinal | ymd)
+    res[stamp] = arg[stamp].astype('datetime64[s]')
+    return res
+
+def _float2dt_vector(arg):
+    """
+    vectorised dt for floats: the integer part is converted as in _int2dt, the fraction is a fraction of a day, nan is NaT
+    """
+    arg = np.asarray(arg, dtype = float)
+    res = np.full(arg.shape, _NaT)
+    ok = np.isfinite(arg)
+    value = arg[ok]
+    fraction = np.round((value % 1) * _SECONDS_IN_A_DAY * 1e6).astype('timedelta64[us]')
+    res[ok] = _int2dt_vector(np.trunc(value).astype(np.int64)) + fraction
+    return res
+
+def _str2dt_vector(arg):
+    """
+    vectorised _str2dt. The strings are classified on their unicode code points:
+    
+    - all digits are converted as integers
+    - yyyy-mm-dd and dd/mm/yyyy (any of ' ', '-', '/' as separator) are converted via their y,m,d digits, with the same UK preference as _str2dt
+    - ISO date-times (yyyy-mm-ddThh:mm:ss.f, no timezone) are parsed by numpy
+    
+    Anything else is left to _str2dt, one string at a time.
+    """
+    arg = np.ascontiguousarray(arg, dtype = str)
+    res = np.full(arg.shape, _NaT)
+    n = len(arg)
+    width = arg.dtype.itemsize // 4
+    left = np.ones(n, dtype = bool)
+    if n and width:
+        codes = arg.view(np.uint32).reshape(n, width) ## a view of the strings, not a copy
+        length = (codes!=0).sum(1)
+        digit = (codes>=48) & (codes<=57)
+        def number(i, j):
+            return (codes[:, i:j].view(np.int32) - 48) @ 10 ** np.arange(j-i-1, -1, -1)
+        ints = (digit | (codes == 0)).all(1) & (length>0) & (length<19)
+        res[ints] = _int2dt_vector(arg[ints].astype(np.int64))
+        left &= ~ints
+        if width >= 10:
+            fixed = left & (length == 10)
+            ymd = fixed & np.isin(codes[:,4], _SEPARATORS) & (codes[:,4] == codes[:,7]) & digit[:,[0,1,2,3,5,6,8,9]].all(1)
+            y = number(0,4)
+            ymd &= y>50
+            res[ymd] = _ymd2dt_array(y[ymd], number(5,7)[ymd], number(8,10)[ymd])
+            dmy = fixed & np.isin(codes[:,2], _SEPARATORS) & (codes[:,2] == codes[:,5]) & digit[:,[0,1,3,4,6,7,8,9]].all(1)
+            d = number(0,2)
+            y = number(6,10)
+            dmy &= (d<=50) & (y>50)
+            res[dmy] = _ymd2dt_array(y[dmy], number(3,5)[dmy], d[dmy])
+            left &= ~(ymd | dmy)
+        if width > 10:
+            iso = left & (length > 10) & (codes[:,4] == 45) & (codes[:,7] == 45) & np.isin(codes[:,10], [84, 32]) & digit[:,[0,1,2,3,5,6,8,9]].all(1)
+            iso &= (np.isin(codes[:,11:], _ISO_TIME) | (codes[:,11:] == 0)).all(1)
+            if iso.any():
+                try:
+                    res[iso] = np.array(arg[iso], dtype = 'datetime64[us]')
+                    left &= ~iso
+                except ValueError:
+                    pass
+    if left.any():
+        res[left] = np.array([_str2dt(a) for a in arg[left]], dtype = 'datetime64[us]')
+    return res
+
+def _dt_kind(value):
+    if value is None:
+        return 0
+    elif isinstance(value, str):
+        return 1
+    elif isinstance(value, (datetime.date, np.datetime64)):
+        return 2
+    elif isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+        return 3
+    else:
+        return 4
+
+def _obj2dt_vector(arg):
+    """
+    vectorised dt over a mixed object array: values are grouped by type and each group converted in bulk
+    """
+    res = np.full(arg.shape, _NaT)
+    kinds = np.array([_dt_kind(v) for v in arg], dtype = int)
+    strs = kinds == 1
+    if strs.any():
+        res[strs] = _str2dt_vector(arg[strs].astype(str))
+    dates = kinds == 2
+    if dates.any():
+        res[dates] = np.array(list(arg[dates]), dtype = 'datetime64[us]')
+    nums = kinds == 3
+    if nums.any():
+        values = np.array(list(arg[nums]))
+        res[nums] = _int2dt_vector(values) if values.dtype.kind in 'iu' else _float2dt_vector(values)
+    other = kinds == 4
+    if other.any():
+        res[other] = np.array([dt(v) for v in arg[other]], dtype = 'datetime64[us]')
+    return res
+   
+def dt_vector(values):
+    """
+    dt_vector (also available as dt.array) is the vectorised version of dt. 
+    Rather than calling dt per value, the whole column is classified once and each class is converted in bulk:
+    integers (yyyymmdd, Excel serials, ordinals...), floats, yyyy-mm-dd & dd/mm/yyyy strings, ISO date-times and datetime64.
+    dateutil is used only for the leftover strings.
+
+    Returns a datetime64[ns] array, or an object array of datetimes if dates fall outside the datetime64[ns] range.
+    
+    >>> import numpy as np
+    >>> res = dt.array([20010901, '2001-09-01', '01/09/2001', 37135, '1st Sep 2001', None])
+    >>> assert res.dtype == np.dtype('datetime64[ns]')
+    >>> assert list(res[:5]) == [np.datetime64('2001-09-01')] * 5 and np.isnat(res[5])
+    >>> assert list(dt.array([1000])) == [np.datetime64(dt(1000))]
+    >>> assert list(dt.array([500000])) == [dt(500000)] ## year 1370 is outside datetime64[ns]
+    """
+    if isinstance(values, np.ndarray) and values.dtype.kind == 'M':
+        res = values.astype('datetime64[us]')
+    else:
+        values = np.asarray(values)
+        shape = values.shape
+        values = values.ravel()
+        kind = values.dtype.kind
+        if kind in 'iu':
+            res = _int2dt_vector(values)
+        elif kind == 'f':
+            res = _float2dt_vector(values)
+        elif kind in 'US':
+            res = _str2dt_vector(values.astype(str))
+        else:
+            res = _obj2dt_vector(values.astype(object))
+        res = res.reshape(shape)
+    ok = ~np.isnat(res)
+    if ((res[ok] >= _NS_MIN) & (res[ok] <= _NS_MAX)).all():
+        return res.astype('datetime64[ns]')
+    else:
+        return res.astype(object)
+
+
 _futs = list('FGHJKMNQUVXZ')
 _months = ['january', 'february', 'march','april', 'may', 'june', 'july', 'august', 'september', 'october', 'november', 'december']
 _mmms = [month[:3] for month in _months]
@@ -224,6 +462,7 @@ dt.today = today
 dt.weekday = weekday
 dt.isoformat = isoformat
 dt.timestamp = timestamp
+dt.array = dt_vector
 
 
 
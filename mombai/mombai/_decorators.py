@@ -5,6 +5,12 @@ from numpy import nan
 import collections
 import logging
 import datetime
+import time
+import hashlib
+import struct
+import pickle
+import os
+import zipfile
 import numpy as np
 
 version = sys.version_info
@@ -58,41 +64,421 @@ def _hashable(key):
     """
     return min([_hashable(k) for k in key]) if isinstance(key, tuple) and len(key) else isinstance(key, collections.Hashable)
 
-def _prehash(value):
+_primitives = (int, np.integer, str, datetime.date, float, np.floating)
+
+def _feed(h, value, strict = True, exact = False):
     """
-    make list and dicts more hashable
+    feeds a canonical, type-tagged encoding of value into the hash object h. 
+    The encoding does not depend on the process (unlike hash() of str) so the resulting digest is stable between sessions.
+    Values that are == in python are encoded the same way, so 1, 1.0 and True are the same; as are a list and a tuple, a dict and a Dict.
+    If exact, the encoding is type-strict instead: bools, ints and floats are tagged B, I and F and lists and tuples L and T. 
+    This is what stores must use, since f(1) and f(1.0) may well return different results.
+    
+    For unsupported types, if strict, we raise a TypeError. Otherwise, we fall back on hash(value) which is stable only within the session
     """
-    if isinstance(value, list):
-        return tuple(value)
+    if value is None:
+        h.update(b'N')
+    elif exact and isinstance(value, (bool, np.bool_)):
+        h.update(b'B%d;' % int(value))
+    elif isinstance(value, (bool, np.bool_, int, np.integer)):
+        h.update(b'I%d;' % int(value))
+    elif isinstance(value, (float, np.floating)):
+        value = float(value)
+        if np.isnan(value):
+            h.update(b'Fnan')
+        elif value.is_integer() and not exact:
+            h.update(b'I%d;' % int(value))
+        else:
+            h.update(b'F' + struct.pack('<d', value))
+    elif isinstance(value, str):
+        data = value.encode('utf-8')
+        h.update(b'S%d;' % len(data))
+        h.update(data)
+    elif isinstance(value, bytes):
+        h.update(b'Y%d;' % len(value))
+        h.update(value)
+    elif isinstance(value, (datetime.datetime, datetime.date, datetime.timedelta, np.datetime64, np.timedelta64)):
+        h.update(('T%s:%s;' % (type(value).__name__, value)).encode('utf-8'))
+    elif isinstance(value, np.ndarray):
+        h.update(('A%s%s;' % (value.dtype.str, value.shape)).encode('utf-8'))
+        if value.dtype == object:
+            for v in value.ravel():
+                _feed(h, v, strict, exact)
+        else:
+            h.update(np.ascontiguousarray(value).data)
+    elif isinstance(value, (list, tuple)):
+        h.update((b'T%d;' if exact and isinstance(value, tuple) else b'L%d;') % len(value))
+        for v in value:
+            _feed(h, v, strict, exact)
+    elif isinstance(value, (set, frozenset)):
+        h.update(b'E%d;' % len(value))
+        for d in sorted(_digest(v, strict, exact) for v in value):
+            h.update(d)
     elif isinstance(value, dict):
-        return tuple(sorted(value.items()))
+        h.update(b'D%d;' % len(value))
+        for d, key in sorted(((_digest(k, strict, exact), k) for k in value.keys()), key = lambda item: item[0]):
+            h.update(d)
+            _feed(h, value[key], strict, exact)
+    elif strict:
+        raise TypeError('cannot compute a content hash for %s'%type(value))
     else:
-        return value
+        h.update(b'H%d;' % hash(value))
+
+def _digest(value, strict = True, exact = False):
+    """
+    a stable content hash of value, using blake2b over a canonical encoding (a type-strict one if exact, see _feed). 
+    >>> assert _digest(dict(a = [1, 2.5], b = 'x')) == _digest(dict(b = 'x', a = [1, 2.5]))
+    >>> assert _digest(np.array([1,2])) != _digest(np.array([1.,2.]))
+    >>> assert _digest([1]) == _digest((1.,)) and _digest([1], exact = True) != _digest((1,), exact = True)
+    """
+    h = hashlib.blake2b(digest_size = 16)
+    _feed(h, value, strict, exact)
+    return h.digest()
+
+def _hash_int(value, exact = False):
+    return int.from_bytes(_digest(value, strict = False, exact = exact)[:8], 'little', signed = True)
 
 def Hash(value):
     """
-    _hash of _hash is the same due to integers not being hashable
-    _hash of dict and list are implemented
+    Hash returns primitives (numbers, strings, dates) as they are, as they are their own hash. 
+    Anything else is hashed by content: nested lists, tuples, dicts, np.ndarray (using the raw buffer), datetimes and Dictables,
+    using blake2b over a canonical encoding. Unlike hash(), the result is the same in every session, so ids based on Hash persist.
+    
+    >>> assert Hash(5) == 5
+    >>> assert Hash(dict(a = 1, b = [1,2])) == Hash(dict(b = [1,2], a = 1))
+    >>> assert Hash(np.array([1.,2.])) == Hash(np.array([1.,2.]))
+
+    Hashes of immutable values (tuples and frozensets) are memoised. Arrays are not: even a read-only array can be made writeable again and modified.
     """
-    value = _prehash(value)
-    if isinstance(value, (int, np.int64, np.int32, np.int64, str, datetime.date, datetime.datetime, float, np.float, np.float16, np.float32, np.float64)):
+    if isinstance(value, _primitives):
         return value
-    else:
-        return hash(value)
+    elif isinstance(value, (tuple, frozenset)):
+        try:
+            return _hash_memo.fetch(value, _hash_int, value)
+        except TypeError: ## tuple with unhashable items
+            pass
+    return _hash_int(value)
 
 
-def _cache_key(function):
-    args = getargs(function)
-    if args and args[0] in ('self', 'cls'):
-        def _key(*args, **kwargs):
-            return (args[1:], tuple(kwargs.items()))
+def _function_digest(function):
+    """
+    identifies a function by its module, name and source code (or bytecode if the source is unavailable)
+    """
+    try:
+        code = inspect.getsource(function)
+    except (OSError, TypeError):
+        code = getattr(function, '__code__', None)
+        code = (code.co_code, repr(code.co_consts)) if code is not None else repr(function)
+    return _digest((getattr(function, '__module__', None), getattr(function, '__qualname__', repr(function)), code))
+
+
+class Cache(collections.OrderedDict):
+    """
+    Cache is the store used by the cache decorator. It is a dict of key : cached value, which can be bounded:
+    :maxsize: maximum number of items held. Once reached, an item is evicted according to policy before a new one is added
+    :ttl: time-to-live in seconds, after which a cached value is recalculated
+    :policy: 'lru' evicts the least recently used item, 'lfu' the least frequently used item
+    
+    For lfu, keys are held in buckets of equal use count, so that the least frequently used key (the oldest in the lowest bucket) is found in O(1).
+    
+    hits, misses and evictions are counted
+    >>> c = Cache(maxsize = 2)
+    >>> assert c.fetch('a', lambda: 1) == 1 and c.fetch('a', lambda: 2) == 1
+    >>> c.fetch('b', lambda: 2); c.fetch('c', lambda: 3)
+    >>> assert list(c.keys()) == ['b', 'c'] and c.stats() == dict(hits = 1, misses = 3, evictions = 1, size = 2, maxsize = 2)
+    """
+    def __init__(self, maxsize = None, ttl = None, policy = 'lru'):
+        super(Cache, self).__init__()
+        if policy not in ('lru', 'lfu'):
+            raise ValueError('cache policy must be lru or lfu, not %s'%policy)
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.policy = policy
+        self.hits = self.misses = self.evictions = 0
+        self._counts = {}
+        self._buckets = {} ## use count : OrderedDict of the keys used that many times
+        self._min_count = 0
+        self._times = {}
+
+    def as_key(self, key, hash_args = False):
+        return _cache_key(key, hash_args)
+
+    def _count(self, key, count):
+        """
+        moves key from its use count bucket to the one for count (or drops it if count is None). 
+        A key is only ever moved up by one, or inserted with count 1, so the lowest count is kept without a search
+        """
+        old = self._counts.pop(key, None)
+        if old is not None:
+            bucket = self._buckets[old]
+            del bucket[key]
+            if not bucket:
+                del self._buckets[old]
+                if self._min_count == old:
+                    self._min_count = count or 0 ## 0 if unknown, found on the next eviction
+        if count is not None:
+            self._counts[key] = count
+            self._buckets.setdefault(count, collections.OrderedDict())[key] = None
+            if count == 1:
+                self._min_count = 1
+
+    def _remove(self, key):
+        del self[key]
+        self._count(key, None)
+        self._times.pop(key, None)
+
+    def _evict(self):
+        if self.policy == 'lfu':
+            if self._min_count not in self._buckets:
+                self._min_count = min(self._buckets)
+            key = next(iter(self._buckets[self._min_count]))
+        else:
+            key = next(iter(self))
+        self._remove(key)
+        self.evictions += 1
+
+    def fetch(self, key, function, *args, **kwargs):
+        """
+        returns the cached value for key, calculating function(*args, **kwargs) if key is missing or expired
+        """
+        if key in self:
+            if self.ttl is None or time.monotonic() - self._times[key] < self.ttl:
+                self.hits += 1
+                if self.maxsize is not None:
+                    if self.policy == 'lfu':
+                        self._count(key, self._counts[key] + 1)
+                    else:
+                        self.move_to_end(key)
+                return self[key]
+            self._remove(key)
+        self.misses += 1
+        value = function(*args, **kwargs)
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        """
+        adds key : value as a new item, evicting first if the cache is full. Its use count is 1 and its time-to-live starts now
+        """
+        if key in self:
+            self._remove(key)
+        if self.maxsize is not None:
+            if self.maxsize <= 0:
+                return
+            while len(self) >= self.maxsize:
+                self._evict()
+            if self.policy == 'lfu':
+                self._count(key, 1)
+        if self.ttl is not None:
+            self._times[key] = time.monotonic()
+        self[key] = value
+
+    def clear(self):
+        super(Cache, self).clear()
+        self._counts.clear()
+        self._buckets.clear()
+        self._min_count = 0
+        self._times.clear()
+
+    def stats(self):
+        return dict(hits = self.hits, misses = self.misses, evictions = self.evictions, size = len(self), maxsize = self.maxsize)
+
+
+def _savez(f, arrays):
+    """
+    writes a dict of arrays in the .npz format. Unlike np.savez(f, **arrays), any key is allowed, including 'file'
+    """
+    with zipfile.ZipFile(f, 'w', zipfile.ZIP_STORED, allowZip64 = True) as z:
+        for key, value in arrays.items():
+            with z.open(key + '.npy', 'w', force_zip64 = True) as npy:
+                np.lib.format.write_array(npy, value, allow_pickle = False)
+
+def _save(filename, value):
+    """
+    saves value to filename + extension, returning the full filename. 
+    Non-object np.ndarray are saved as .npy, Dictables with non-object columns as .npz (one array per column), anything else is pickled
+    """
+    from mombai._dictable import Dictable
+    if isinstance(value, np.ndarray) and value.dtype != object:
+        filename, save = filename + '.npy', lambda f: np.save(f, value, allow_pickle = False)
+    elif isinstance(value, Dictable) and min([isinstance(k, str) and isinstance(v, np.ndarray) and v.dtype != object for k, v in value.items()] + [True]):
+        filename, save = filename + '.npz', lambda f: _savez(f, value)
+    else:
+        filename, save = filename + '.pkl', lambda f: pickle.dump(value, f, protocol = pickle.HIGHEST_PROTOCOL)
+    tmp = filename + '.tmp%s' % os.getpid()
+    try:
+        with open(tmp, 'wb') as f:
+            save(f)
+        os.replace(tmp, filename)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return filename
+
+def _load(filename):
+    if filename.endswith('.npy'):
+        return np.load(filename, allow_pickle = False)
+    elif filename.endswith('.npz'):
+        from mombai._dictable import Dictable
+        with np.load(filename, allow_pickle = False) as data:
+            return Dictable({key : data[key] for key in data.files})
     else:
-        def _key(*args, **kwargs):
-            return (args, tuple(kwargs.items()))
-    return _key
+        with open(filename, 'rb') as f:
+            return pickle.load(f)
+
+
+class DiskCache(object):
+    """
+    DiskCache is a persistent store for the cache decorator, so that results survive a restart of the session. 
+    Each call is saved in its own file under path/function_name, named by a stable content hash of the function (name and source code) and of the arguments.
+    The arguments are bound to the signature of the function first, so f(3), f(n = 3) and f(3, default) share a file.
+    :maxbytes: once the files under path exceed maxbytes, the least recently used files are deleted
+    
+    >>> @cache(store = 'disk', path = 'c:/temp/cache', maxbytes = 2**30)
+    >>> def load_prices(ticker, start, end):
+    >>>     ...
+    """
+    _extensions = ('.npy', '.npz', '.pkl')
+
+    def __init__(self, function, path = None, maxbytes = None):
+        self.path = os.path.expanduser(path or os.path.join('~', '.mombai', 'cache'))
+        self.folder = os.path.join(self.path, getattr(function, '__qualname__', 'function').replace('<', '').replace('>', ''))
+        self.maxbytes = maxbytes
+        self.prefix = _function_digest(function)
+        self.hits = self.misses = self.evictions = 0
+        self._bytes = None
+        try:
+            self._signature = inspect.signature(function)
+        except (TypeError, ValueError): ## some builtins have no signature
+            self._signature = None
+
+    def _arguments(self, args, kwargs):
+        """
+        the arguments as a dict of parameter : value, including defaults. If they do not bind to the signature, (args, kwargs)
+        """
+        if self._signature is not None:
+            try:
+                bound = self._signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                return dict(bound.arguments)
+            except TypeError:
+                pass
+        return (args, kwargs)
+
+    def as_key(self, key, hash_args = False):
+        """
+        the key is a hex digest of the function and of the arguments bound to its signature. None if the args cannot be hashed
+        """
+        try:
+            return _digest((self.prefix, self._arguments(key[0], dict(key[1]))), exact = True).hex()
+        except TypeError:
+            return None
+
+    def _find(self, key):
+        for ext in self._extensions:
+            filename = os.path.join(self.folder, key + ext)
+            if os.path.isfile(filename):
+                return filename
+        return None
+
+    def fetch(self, key, function, *args, **kwargs):
+        filename = self._find(key)
+        if filename is not None:
+            try:
+                value = _load(filename)
+                os.utime(filename)
+                self.hits += 1
+                return value
+            except Exception:
+                logging.warning('could not load %s from cache, recalculating'%filename)
+        self.misses += 1
+        value = function(*args, **kwargs)
+        os.makedirs(self.folder, exist_ok = True)
+        try:
+            filename = _save(os.path.join(self.folder, key), value)
+        except Exception:
+            logging.warning('could not save %s to cache'%os.path.join(self.folder, key))
+            return value
+        self._evict(os.path.getsize(filename))
+        return value
+
+    def _files(self):
+        res = []
+        for root, _, files in os.walk(self.path):
+            for fn in files:
+                if fn.endswith(self._extensions):
+                    stat = os.stat(os.path.join(root, fn))
+                    res.append((stat.st_mtime, stat.st_size, os.path.join(root, fn)))
+        return res
+
+    def _evict(self, size):
+        """
+        The total size of the files is tracked in memory after a first walk over path, so we only walk path again once maxbytes is exceeded
+        """
+        if self.maxbytes is None:
+            return
+        if self._bytes is None:
+            self._bytes = sum([size for _, size, _ in self._files()])
+        else:
+            self._bytes += size
+        if self._bytes <= self.maxbytes:
+            return
+        files = sorted(self._files())
+        total = sum([size for _, size, _ in files])
+        for _, size, filename in files:
+            if total <= self.maxbytes:
+                break
+            os.remove(filename)
+            total -= size
+            self.evictions += 1
+        self._bytes = total
+
+    def __len__(self):
+        return len([fn for fn in os.listdir(self.folder) if fn.endswith(self._extensions)]) if os.path.isdir(self.folder) else 0
+
+    def clear(self):
+        if os.path.isdir(self.folder):
+            for fn in os.listdir(self.folder):
+                if fn.endswith(self._extensions):
+                    os.remove(os.path.join(self.folder, fn))
+        self._bytes = None
+
+    def stats(self):
+        return dict(hits = self.hits, misses = self.misses, evictions = self.evictions, size = len(self), maxbytes = self.maxbytes)
+
+
+_hash_memo = Cache(maxsize = 4096)
+
+_HASHED = object()
+
+def _hash_arg(value):
+    """
+    an unhashable argument is replaced by its type-strict content hash, marked so it cannot clash with a hashable argument
+    """
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return (_HASHED, _hash_int(value, exact = True))
+
+def _cache_key(key, hash_args = False):
+    """
+    key is of the form (..., args, kwargs_items). Returns key if it is hashable. 
+    Otherwise, if hash_args, we replace unhashable args by their Hash. If this fails too, we return None and the call is not cached
+    """
+    try:
+        hash(key)
+        return key
+    except TypeError:
+        if not hash_args:
+            return None
+    try:
+        return key[:-2] + (tuple(_hash_arg(a) for a in key[-2]), tuple((k, _hash_arg(v)) for k, v in key[-1]))
+    except TypeError:
+        return None
 
 
-def cache_method(function):
+def cache_method(function, maxsize = None, ttl = None, policy = 'lru', hash_args = False, store = None, path = None, maxbytes = None):
     """
     >>> import datetime
     >>> import time
@@ -107,50 +493,69 @@ def cache_method(function):
 
     >>> d = Clock()
     >>> assert d.time()>t    
+    
+    The cache is held on the instance, in self.cache, and is shared by all the cached methods of the instance. 
+    Its maxsize, ttl and policy therefore apply to all of them: methods of the same instance asking for different settings raise a ValueError.
     """
+    if store == 'disk':
+        raise ValueError('a disk store is only supported for functions, not for methods of %s'%function.__name__)
     name = function.__name__
-    def _key(*args, **kwargs):
-        return (name, args[1:], tuple(kwargs.items()))
     def wrapped(*args, **kwargs):
-        key = _prehash(_key(*args, **kwargs))
-        me = args[0]
-        if _hashable(key):
-            me.cache = getattr(me, 'cache', {})
-            if key not in me.cache:
-                me.cache[key] = function(*args, **kwargs)
-            return me.cache[key]
-        else:
+        key = _cache_key((name, args[1:], tuple(kwargs.items())), hash_args)
+        if key is None:
             return function(*args, **kwargs)
+        me = args[0]
+        store = getattr(me, 'cache', None)
+        if not isinstance(store, Cache):
+            me.cache = Cache(maxsize, ttl, policy)
+            for k, v in (store or {}).items(): ## a plain dict already in self.cache is adopted, item by item
+                me.cache.put(k, v)
+            store = me.cache
+        elif (store.maxsize, store.ttl, store.policy) != (maxsize, ttl, policy):
+            raise ValueError('cached methods share self.cache, set up with maxsize=%s, ttl=%s, policy=%s, but %s asks for maxsize=%s, ttl=%s, policy=%s'%(
+                              store.maxsize, store.ttl, store.policy, name, maxsize, ttl, policy))
+        return store.fetch(key, function, *args, **kwargs)
     result = decorate(wrapped, function)
     return result
 
-def cache_func(function):
-    def _key(*args, **kwargs):
-        return (args, tuple(kwargs.items()))
+def cache_func(function, maxsize = None, ttl = None, policy = 'lru', hash_args = False, store = None, path = None, maxbytes = None):
     def wrapped(*args, **kwargs):
-        key = _prehash(_key(*args, **kwargs))
-        if _hashable(key):
-            wrapped.cache =  getattr(wrapped, 'cache', {})
-            if key not in wrapped.cache:
-                wrapped.cache[key] = function(*args, **kwargs)
-            return wrapped.cache[key]
-        else: 
+        key = wrapped.cache.as_key((args, tuple(kwargs.items())), hash_args)
+        if key is None:
             return function(*args, **kwargs)
+        return wrapped.cache.fetch(key, function, *args, **kwargs)
     result = decorate(wrapped, function)
-    result.cache = {}
+    if store == 'disk':
+        result.cache = DiskCache(function, path = path, maxbytes = maxbytes)
+    elif store is None or store == 'memory':
+        result.cache = Cache(maxsize, ttl, policy)
+    else:
+        raise ValueError('cache store must be memory or disk, not %s'%store)
     return result
     
 
-def cache(function):
+def cache(function = None, maxsize = None, ttl = None, policy = 'lru', hash_args = False, store = None, path = None, maxbytes = None):
     """
     A decorator for a function, where a function call arguments are hashable, will cache on that key
-
+    It can be used directly, @cache, or with parameters controlling the Cache store:
+    
+    >>> @cache(maxsize = 100, ttl = 3600, policy = 'lfu', hash_args = True)
+    >>> def load(path, columns):
+    >>>     ...
+    >>> load.cache.stats()
+    
+    :maxsize, ttl, policy: see Cache
+    :hash_args: by default, calls with unhashable arguments (lists, dicts, np.ndarray) are not cached. If True, we key on their Hash instead
+    :store: 'memory' (default) or 'disk' in which case results are persisted under path, see DiskCache
     """
+    params = dict(maxsize = maxsize, ttl = ttl, policy = policy, hash_args = hash_args, store = store, path = path, maxbytes = maxbytes)
+    if function is None:
+        return partial(cache, **params)
     args = getargs(function)
     if args and args[0] in ('self', 'cls'):
-        return cache_method(function)
+        return cache_method(function, **params)
     else:
-        return cache_func(function)
+        return cache_func(function, **params)
     
 
 def try_value(value):
@@ -249,6 +654,9 @@ def support_kwargs(relabels=None):
     >>> assert relabeled_func(1,2,3) == 6
     >>> assert relabeled_func(a=1,BB=2,C=3,other_parameters_that_are_now_ignaored = 100)==6
     
+    If the function does not take **kwargs, the (relabeled) args can be fed positionally instead, as listed in wrapped.positional:
+    >>> assert relabeled_func.positional == ['a', 'BB', 'C']
+    
     Now, let us examine where the function already supports kwargs, we add relabeling for the args only!
     >>> function = lambda x, **kwargs : ' '.join(['x'*x] + [key*value for key, value in kwargs.items()]) 
     >>> assert support_kwargs()(function)(x=1, b=2, c=3) == 'x bb ccc'
@@ -263,6 +671,7 @@ def support_kwargs(relabels=None):
             def wrapped(*args, **kwargs):
                 return function(*args)
             return wrapped
+        args2keys = {arg : relabel(arg, relabels) for arg in argspec.args}
         def wrapped(*args, **kwargs):
             """
             We need to supprt the case where varkw isnt None: the function expect parameters whose name we do not know.
@@ -272,13 +681,15 @@ def support_kwargs(relabels=None):
             >>> assert support_kwargs(dict(x='a'))(function)(a = 1, b=2, c=3) == 'xbbccc'
             support_kwargs(dict(x='a', y='b'))(function)(x=1, b=2, c=3) == 'xbbccc' # we never relabel kwargs. 
             """
-            args2keys = {arg : relabel(arg, relabels) for arg in argspec.args}
+            if not kwargs:
+                return function(*args)
             parameters = {arg : kwargs.pop(key) for arg, key in args2keys.items() if key in kwargs}
             if argspec.varkw is not None:
                 parameters.update(kwargs)
             return function(*args, **parameters)
         wrapped = decorate(wrapped, function)
         setattr(wrapped, ARGSPEC, argspec_update(argspec, varkw = 'kwargs', args = relabel(argspec.args, relabels), defaults = relabel(argspec.defaults, relabels)))
+        wrapped.positional = relabel(argspec.args, relabels) if argspec.varkw is None and not argspec.kwonlyargs else None
         return wrapped
     return decorator
 
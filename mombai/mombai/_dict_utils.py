@@ -1,8 +1,12 @@
-from mombai._containers import as_type, args_zip, args_to_list, as_list
-from functools import reduce
+from mombai._containers import as_type, args_zip, args_to_list, as_list, concat, _pandas_types
+from mombai._decorators import cache
+from itertools import repeat
+import json
+import mmap
+import re
+import os
 from copy import copy
 import numpy as np
-import pandas as pd
 
 def dict_zip(d, dict_type=None):
     """
@@ -49,13 +53,20 @@ def dict_apply(d, func=None, funcs=None):
     func = func or pass_thru
     return {key : (funcs.get(key, func) or pass_thru)(value) for key, value in d.items()} 
 
+def _keys_union(dicts):
+    """
+    the union of the keys of all dicts, in order of first appearance, computed in linear time
+    >>> assert _keys_union([dict(a=1, b=2), dict(c=3, a=4)]) == ['a', 'b', 'c']
+    """
+    return list(dict.fromkeys(key for d in dicts for key in d.keys()))
+
 def dict_concat(*dicts, keys = None):
     """
     >>> dicts = [{'a': 1, 'b': 4, 'c': 7, 'x' : 1}, {'a': 2, 'b': 5, 'c': 8, 'y' : 2}, {'a': 3, 'b': 6, 'c': 9, 'z' : 3}]
     >>> assert dict_concat(dicts) == {'a': [1, 2, 3], 'b': [4, 5, 6], 'c': [7, 8, 9], 'x': [1, None, None], 'y': [None, 2, None], 'z': [None, None, 3]}
     """ 
     dicts = args_to_list(dicts)
-    keys = set(sum([list(d.keys()) for d in dicts], [])) if keys is None else as_list(keys)
+    keys = _keys_union(dicts) if keys is None else as_list(keys)
     return {key : [d.get(key) for d in dicts] for key in keys}
 
 
@@ -66,23 +77,21 @@ def dict_append(*dicts, keys = None):
     >>> 
     """
     dicts = args_to_list(dicts)
-    keys = set(sum([list(d.keys()) for d in dicts], [])) if keys is None else as_list(keys)
-    return {key : [d[key] for d in dicts if key in d] for key in keys}
+    res = {} if keys is None else {key : [] for key in as_list(keys)}
+    for d in dicts:
+        for key, value in d.items():
+            if keys is None:
+                res.setdefault(key, []).append(value)
+            elif key in res:
+                res[key].append(value)
+    return res
         
 def dict_update_right(*dicts, keys = None, **kwargs):
     """
     >>> dicts = [{'a': 1, 'b': 4, 'c': 7, 'x' : 1}, {'a': 2, 'b': 5, 'c': 8, 'y' : 2}, {'a': 3, 'b': 6, 'c': 9, 'z' : 3}]
     >>> assert dict_update_right(dicts) == {'a': 3, 'b': 6, 'c': 9, 'z' : 3, 'y' : 2,  'x' : 1}
     """
-    dicts = args_to_list(dicts)[::-1]
-    keys = set(sum([list(d.keys()) for d in dicts], [])) if keys is None else as_list(keys)
-    res = {}
-    for key in keys:
-        for d in dicts:
-            if key in d:
-                res[key] = d[key]
-                break
-    return res
+    return dict_update_left(args_to_list(dicts)[::-1], keys = keys)
 
 def dict_update_left(*dicts, keys = None, **kwargs):
     """
@@ -91,13 +100,12 @@ def dict_update_left(*dicts, keys = None, **kwargs):
     >>> 
     """
     dicts = args_to_list(dicts)
-    keys = set(sum([list(d.keys()) for d in dicts], [])) if keys is None else as_list(keys)
+    wanted = None if keys is None else set(as_list(keys))
     res = {}
-    for key in keys:
-        for d in dicts:
-            if key in d:
-                res[key] = d[key]
-                break
+    for d in dicts:
+        for key, value in d.items():
+            if key not in res and (wanted is None or key in wanted):
+                res[key] = value
     return res
 
 
@@ -112,15 +120,7 @@ def dict_invert(d):
     return res
 
 
-_merge_policies= {'l' : dict_update_left, 'r' : dict_update_right, 'c' : dict_concat, 'a' : dict_append, 'left' : dict_update_left, 'right' : dict_update_right, 'concat' : dict_concat, 'append' : dict_append}
-
-
-def _dict_update(left, right):
-    left.update(right)
-    return left
-
-
-def dict_merge(dicts, policy='c', dict_type = None, policies=None, **kwargs):
+def dict_merge(dicts, policy='c', dict_type = None, policies=None, keys = None, columnar = False, **kwargs):
     """
     When we have two (or more) dicts where we want to merge them. If the keys don't overlap, there is no problems.
     However, if there are two identical keys, we need to have a policy:
@@ -129,24 +129,62 @@ def dict_merge(dicts, policy='c', dict_type = None, policies=None, **kwargs):
     'append': per each key, create a list of the values whichever dict have this key
     'concat': per each key, create a fixed length list, each dict will provide d.get(key)
     
-    policies allow us to apply very specific policy per specific keys
+    policies allow us to apply very specific policy per specific keys, these can also be provided as keyword arguments.
+    All policies are computed in a single pass over the dicts.
     >>> dicts = [{'a': 1, 'b': 4, 'c': 7, 'x' : 1}, {'a': 2, 'b': 5, 'c': 8, 'y' : 2}, {'a': 3, 'b': 6, 'c': 9, 'z' : 3}]
     >>> assert dict_merge(dicts, 'c') ==  {'a': [1, 2, 3], 'b': [4, 5, 6], 'c': [7, 8, 9], 'x': [1, None, None], 'y': [None, 2, None], 'z': [None, None, 3]}
     >>> assert dict_merge(dicts, 'a') == {'a': [1, 2, 3], 'b': [4, 5, 6], 'c': [7, 8, 9], 'x': [1], 'y': [2], 'z': [3]}
     >>> assert dict_merge(dicts, 'r') == {'a': 3, 'b': 6, 'c': 9, 'z' : 3, 'y' : 2,  'x' : 1}
     >>> assert dict_merge(dicts, 'l') == {'a': 1, 'b': 4, 'c': 7, 'z' : 3, 'y' : 2,  'x' : 1}
     >>> assert dict_merge(dicts, policy = 'l', x = 'a', y='c') ==  {'a': 1, 'b': 4, 'c': 7, 'z' : 3, 'y' : [None, 2, None],  'x' : [1]}
+    
+    columnar=True treats the dicts as tables, i.e. dicts of equal length columns (such as Dictable): 
+    'concat' stacks the columns vertically, filling columns a table does not have with None, and 'append' stacks them side by side (see hstack)
+    >>> tables = [dict(a = np.array([1,2]), b = np.array([3,4])), dict(a = np.array([5]))]
+    >>> merged = dict_merge(tables, 'c', columnar = True)
+    >>> assert list(merged['a']) == [1,2,5] and list(merged['b']) == [3,4,None]
     >>>
     """
     dicts = args_to_list(dicts)
     dict_type = as_type(dict_type or (type(dicts[0]) if len(dicts)>0 else dict))
-    keys = set(sum([list(d.keys()) for d in dicts], []))
-    policies = policies or {}
-    policy_to_keys = dict_invert({key: policies.get(key,policy) for key in keys})
-    for p, keys in policy_to_keys.items():
-        _merge_policies[p[0].lower()](dicts, keys = keys)
-    policy_to_dict = {p : _merge_policies[p[0].lower()](dicts, keys = keys, **kwargs) for p, keys in policy_to_keys.items()}
-    return reduce(_dict_update, policy_to_dict.values(), dict_type())
+    policies = dict(policies or {}, **kwargs)
+    wanted = None if keys is None else set(as_list(keys))
+    found = {}
+    for i, d in enumerate(dicts):
+        for key, value in d.items():
+            if wanted is None or key in wanted:
+                found.setdefault(key, []).append((i, value))
+    n = len(dicts)
+    res = dict_type()
+    for key, values in found.items():
+        p = policies.get(key, policy)
+        p = p[0].lower() if isinstance(p, str) and len(p) else p
+        if p == 'l':
+            res[key] = values[0][1]
+        elif p == 'r':
+            res[key] = values[-1][1]
+        elif p == 'a':
+            res[key] = [value for _, value in values]
+            if columnar:
+                res[key] = hstack(res[key])
+        elif p == 'c':
+            if len(values) == n:
+                column = [value for _, value in values]
+            else:
+                column = [np.full(_table_len(d), None, dtype = object) if columnar else d.get(key) for d in dicts]
+                for i, value in values:
+                    column[i] = value
+            res[key] = concat(column) if columnar else column
+        else:
+            raise ValueError('unknown merge policy %s for key %s'%(policies.get(key, policy), key))
+    return res
+
+
+def hstack(value):
+    return np.asarray(value).T if len(value)>1 else value[0]
+
+def _table_len(table):
+    return len(next(iter(table.values()))) if len(table) else 0
 
 
 def _dicts_update(dicts, d):
@@ -177,29 +215,181 @@ def tree_to_dicts(tree, match):
     >>> assert tree_to_dicts(tree, 'teachers/tid01/name/adam') == [] ## not exists
     >>> assert tree_to_dicts(tree, 'teachers/tid01/name/richard/whatever') == []
     """
-    match = match.split('/') if isinstance(match, str) else match
-    if len(match) == 0:
-        return [{}]
-    key = match[0]
-    if isinstance(tree, dict): ## it is on the branch       
-        t = dict(tree)
-        if key.startswith('%'):
-            return sum([_dicts_update(tree_to_dicts(t[k], match[1:]), {key[1:]:k}) for k in tree], [])
+    return [dict(params[::-1]) for params in _tree_params(tree, match)] ## a repeated parameter keeps its first value
+
+
+def _tree_params(tree, match):
+    """
+    a generator of the matches of the pattern in the tree, each a tuple of (parameter, value) in pattern order. 
+    We traverse the tree depth-first using an explicit stack, so the order is that of the keys in the tree.
+    """
+    match = _as_pattern(match)
+    n = len(match)
+    stack = [(tree, 0, ())]
+    while stack:
+        node, i, params = stack.pop()
+        if i == n:
+            yield params
+            continue
+        key = match[i]
+        if isinstance(node, dict): ## it is on the branch       
+            if key.startswith('%'):
+                name = key[1:]
+                stack.extend([(child, i + 1, params + ((name, k),)) for k, child in reversed(list(dict.items(node)))])
+            elif key in node:
+                stack.append((dict.__getitem__(node, key), i + 1, params))
+        elif i == n - 1: # tree is the leaf
+            if key.startswith('%'):
+                yield params + ((key[1:], node),)
+            elif key == node:
+                yield params
+
+
+def tree_to_columns(tree, match):
+    """
+    Same as dict_concat(tree_to_dicts(tree, match)) but fills a list per parameter directly, without creating a dict per match.
+    Returns {} if nothing matches.
+    >>> tree = dict(students = dict(id01 = dict(name = 'james'), id02 = dict(name = 'steve')))
+    >>> assert tree_to_columns(tree, 'students/%id/name/%name') == dict(id = ['id01', 'id02'], name = ['james', 'steve'])
+    """
+    return _params_to_columns(match, _tree_params(tree, match))
+
+
+def _params_to_columns(match, matches):
+    names = [key[1:] for key in _as_pattern(match) if key.startswith('%')]
+    columns = {name : [] for name in names}
+    appends = [columns[name].append for name in names]
+    if len(columns) < len(names): ## a repeated parameter keeps its first value, as in tree_to_dicts
+        first = {name : i for i, name in reversed(list(enumerate(names)))}
+        appends = [columns[name].append if first[name] == i else None for i, name in enumerate(names)]
+    n = 0
+    for params in matches:
+        n += 1
+        for append, (_, value) in zip(appends, params):
+            if append is not None:
+                append(value)
+    return columns if n else {}
+
+
+
+_JSON_WS = re.compile(rb'[ \t\n\r]*')
+_JSON_STRING = re.compile(rb'"(?:[^"\\]|\\.)*"', re.S)
+_JSON_SCALAR = re.compile(rb'[^,}\]\s]+')
+_JSON_SPECIAL = re.compile(rb'["{}\[\]]')
+
+
+def _json_ws(buf, pos):
+    return _JSON_WS.match(buf, pos).end()
+
+def _json_end(pattern, buf, pos, expected):
+    """
+    returns the end of the match of pattern at pos, raising a ValueError if there is none
+    """
+    m = pattern.match(buf, pos)
+    if m is None:
+        raise ValueError('expected %s at position %i'%(expected, pos))
+    return m.end()
+
+def _json_skip(buf, pos):
+    """
+    returns the position just after the JSON value starting at pos, without decoding it
+    """
+    c = buf[pos:pos+1]
+    if c == b'"':
+        return _json_end(_JSON_STRING, buf, pos, 'a string')
+    elif c not in (b'{', b'['):
+        return _json_end(_JSON_SCALAR, buf, pos, 'a value')
+    depth = 0
+    while True:
+        m = _JSON_SPECIAL.search(buf, pos)
+        if m is None:
+            raise ValueError('unterminated JSON value')
+        c = m.group()
+        if c == b'"':
+            pos = _json_end(_JSON_STRING, buf, m.start(), 'a string')
+            continue
+        pos = m.end()
+        depth += 1 if c in (b'{', b'[') else -1
+        if depth == 0:
+            return pos
+
+def _json_params(buf, pos, match, out, i = 0, params = ()):
+    """
+    Streams over JSON text, appending to out the same matches as _tree_params(json.loads(text), match).
+    Only leaves bound to the pattern are decoded; subtrees that do not match the fixed keys of the pattern are skipped without being built.
+    As in json.loads, a key repeated within an object keeps the position of its first occurrence and the value of its last: 
+    the matches of each key are a slice of out, which we only reorder if an object repeats a key.
+    Returns the position just after the value at pos.
+    """
+    n = len(match)
+    pos = _json_ws(buf, pos)
+    if i == n:
+        out.append(params)
+        return _json_skip(buf, pos)
+    key = match[i]
+    if buf[pos:pos+1] != b'{':
+        end = _json_skip(buf, pos)
+        if i == n - 1:
+            value = json.loads(buf[pos:end])
+            if key.startswith('%'):
+                out.append(params + ((key[1:], value),))
+            elif key == value:
+                out.append(params)
+        return end
+    pos = _json_ws(buf, pos + 1)
+    if buf[pos:pos+1] == b'}':
+        return pos + 1
+    base = len(out)
+    slices = {} ## key : (start, end) of its matches in out
+    repeated = False
+    while True:
+        end = _json_end(_JSON_STRING, buf, pos, 'a string key')
+        k = json.loads(buf[pos:end])
+        pos = _json_ws(buf, end)
+        if buf[pos:pos+1] != b':':
+            raise ValueError('expected : at position %i'%pos)
+        pos = pos + 1
+        if key.startswith('%') or key == k:
+            start = len(out)
+            pos = _json_params(buf, pos, match, out, i + 1, params + ((key[1:], k),) if key.startswith('%') else params)
+            repeated = repeated or k in slices
+            slices[k] = (start, len(out))
         else:
-            if key in tree:
-                return tree_to_dicts(t[key], match[1:])
-            else:
-                return []
-    else: # tree is the leaf
-        if len(match) > 1: 
-            return []
-        elif key.startswith('%'):
-            return [{key[1:] : tree}]
-        elif key == tree:
-            return [{}]
-        else:
-            return []
-           
+            pos = _json_skip(buf, _json_ws(buf, pos))
+        pos = _json_ws(buf, pos)
+        c = buf[pos:pos+1]
+        if c == b'}':
+            if repeated:
+                out[base:] = [row for start, stop in slices.values() for row in out[start:stop]]
+            return pos + 1
+        elif c != b',':
+            raise ValueError('expected , or } at position %i'%pos)
+        pos = _json_ws(buf, pos + 1)
+
+
+def tree_file_to_columns(path, match):
+    """
+    Same as tree_to_columns(tree, match) where tree is the document stored in path. 
+    JSON files are memory-mapped and streamed: only leaves bound to the pattern are decoded.
+    A key repeated within a JSON object keeps its last value, as in json.loads.
+    YAML (.yaml/.yml) files require PyYAML, an optional dependency, and are loaded in full, as there is no incremental loader for them in the standard library.
+    """
+    if os.path.splitext(path)[1].lower() in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError('reading %s requires PyYAML (pip install pyyaml)'%path)
+        with open(path) as f:
+            return tree_to_columns(yaml.safe_load(f), match)
+    match = _as_pattern(match)
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError('%s is empty'%path)
+        with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as buf:
+            matches = []
+            _json_params(buf, 0, match, matches)
+            return _params_to_columns(match, matches)
+
 
 def tree_items(tree, types = dict):
     """
@@ -226,20 +416,26 @@ def tree_items(tree, types = dict):
                                      ('students', 'id02', 'classes', ['maths', 'physics'])]
     
     """
-    if isinstance(tree, types):
-        return sum([[(key,) + node for node in tree_items(tree[key])] for key in tree.keys()], [])
-    else:
-        return [(tree,)]
+    return list(iter_tree_items(tree, types))
+
+
+def iter_tree_items(tree, types = dict):
+    """
+    a generator version of tree_items, traversing the tree using an explicit stack rather than recursion
+    """
+    stack = [((), tree)]
+    while stack:
+        path, node = stack.pop()
+        if isinstance(node, types):
+            stack.extend([(path + (key,), node[key]) for key in reversed(list(node.keys()))])
+        else:
+            yield path + (node,)
+
 
 def _is_pattern(pattern):
-    if not isinstance(pattern, str):
-        return False
-    pattern = pattern.split('/')
-    if not max([p.startswith('%') for p in pattern]):
-        return False
-    if max(['%' in p[1:] for p in pattern]):
+    if not isinstance(pattern, str) or '%' not in pattern:
         return False
-    return True
+    return as_tree_pattern(pattern).is_pattern
 
 def _as_pattern(pattern):
     return pattern.split('/') if isinstance(pattern, str) else pattern    
@@ -305,6 +501,76 @@ def items_to_tree(items, tree = dict, raise_if_duplicate = True):
     return res
 
 
+class TreePattern(object):
+    """
+    A pattern such as 'students/%name/classes/%subject/%grade', parsed once. Use as_tree_pattern to get a cached, compiled pattern.
+    
+    >>> pattern = as_tree_pattern('students/%name/classes/%subject/%grade')
+    >>> assert pattern.names == ['name', 'subject', 'grade']
+    >>> tree = pattern.build(dict(name = ['adam', 'adam'], subject = ['maths', 'physics'], grade = [90, 80]))
+    >>> assert tree == dict(students = dict(adam = dict(classes = dict(maths = 90, physics = 80))))
+    >>> assert pattern.extract(tree) == dict(name = ['adam', 'adam'], subject = ['maths', 'physics'], grade = [90, 80])
+    """
+    def __init__(self, pattern):
+        self.pattern = list(_as_pattern(pattern))
+        self.is_pattern = max([p.startswith('%') for p in self.pattern], default = False) and not max(['%' in p[1:] for p in self.pattern], default = False)
+        self.names = list(dict.fromkeys(p[1:] for p in self.pattern if p.startswith('%')))
+        self.segments = [(p, self.names.index(p[1:]) if p.startswith('%') else None) for p in self.pattern]
+
+    def extract(self, tree):
+        """
+        returns the columns, {name: list of values}, of all the matches of the pattern in the tree. See tree_to_columns
+        """
+        return tree_to_columns(tree, self.pattern)
+
+    def build(self, table, tree = dict, raise_if_duplicate = True):
+        """
+        builds a tree from table, a dict of columns, same as items_to_tree(_pattern_to_item(pattern, row) for row in table), 
+        reading the columns directly. Duplicates are found by hashing each leaf as it is inserted.
+        """
+        if len(self.pattern) < 2:
+            raise ValueError('pattern too short %s'%self.pattern)
+        columns = [table[name] for name in self.names]
+        rows = zip(*columns) if columns else repeat((), len(table))
+        res = tree() if isinstance(tree, type) else copy(tree)
+        base = type(res)
+        branches, (leaf_key, leaf_idx), (value, value_idx) = self.segments[:-2], self.segments[-2], self.segments[-1]
+        seen = set()
+        for row in rows:
+            node = res
+            for key, idx in branches:
+                if idx is not None:
+                    key = row[idx]
+                if key not in node:
+                    node[key] = base()
+                node = node[key]
+            key = leaf_key if leaf_idx is None else row[leaf_idx]
+            if raise_if_duplicate:
+                leaf = (id(node), key)
+                if leaf in seen:
+                    raise ValueError('items are not unique and overwriting each other')
+                seen.add(leaf)
+            node[key] = value if value_idx is None else row[value_idx]
+        return res
+
+    def __repr__(self):
+        return 'TreePattern(%s)'%'/'.join(map(str, self.pattern))
+
+
+@cache(maxsize = 256)
+def _tree_pattern(pattern):
+    return TreePattern(pattern)
+
+def as_tree_pattern(pattern):
+    """
+    returns a compiled TreePattern, cached per pattern
+    >>> assert as_tree_pattern('a/%b') is as_tree_pattern('a/%b') is as_tree_pattern(['a', '%b'])
+    """
+    if isinstance(pattern, TreePattern):
+        return pattern
+    return _tree_pattern('/'.join(pattern) if isinstance(pattern, (list, tuple)) and all(isinstance(p, str) for p in pattern) else pattern)
+
+
 def data_and_columns_to_dict(data=None, columns=None):
     """
     data is assumed to be a list of records (i.e. horizontal) rather than column inputs
@@ -313,6 +579,7 @@ def data_and_columns_to_dict(data=None, columns=None):
     >>> assert data_and_columns_to_dict(data, columns) == {'a': (1, 3, 5), 'b': (2, 4, 6)}
     
     We can convert from pandas:
+    >>> import pandas as pd
     >>> df = pd.DataFrame(data=data, columns = columns)
     >>> dfa = df.set_index('a')
     >>> assert data_and_columns_to_dict(df)['a'] == [1,3,5]
@@ -331,7 +598,7 @@ def data_and_columns_to_dict(data=None, columns=None):
     elif columns is not None:
         if isinstance(columns, str):
             if isinstance(data, dict) and _is_pattern(columns):
-                return dict_concat(tree_to_dicts(data, columns))
+                return as_tree_pattern(columns).extract(data)
             else:
                 return {columns : as_list(data)}
         else:
@@ -339,8 +606,9 @@ def data_and_columns_to_dict(data=None, columns=None):
             return dict(zip(columns, args_zip(*data)))
     else:
         if isinstance(data, str):
+            import pandas as pd
             data = pd.read_csv(data)
-        if isinstance(data, pd.DataFrame):
+        if isinstance(data, _pandas_types('DataFrame')):
             if data.index.name is not None:
                 data = data.reset_index()
             return data.to_dict('list')
@@ -1,12 +1,10 @@
 from _collections_abc import dict_keys
 from mombai._decorators import decorate, try_back, support_kwargs, relabel, cache
 from mombai._compare import Cmp, eq, Sort
-from mombai._containers import as_ndarray, as_list, args_zip, _args_len, args_to_list, args_to_dict, slist , _getitem_as_array, concat, as_str, nplist
-from mombai._dict_utils import dict_apply, dict_zip, dict_concat, dict_merge, data_and_columns_to_dict, items_to_tree, _pattern_to_item, _is_pattern, _as_pattern
+from mombai._containers import as_ndarray, as_list, args_zip, args_len, _args_len, args_to_list, args_to_dict, slist , _is_bool_mask, concat, as_str, nplist
+from mombai._dict_utils import dict_zip, dict_concat, dict_merge, data_and_columns_to_dict, _is_pattern, as_tree_pattern, tree_file_to_columns, hstack
 from mombai._dict import Dict
 import numpy as np
-import pandas as pd
-from prettytable import PrettyTable
 from functools import partial
 #from tqdm import tqdm
 
@@ -25,8 +23,166 @@ def cartesian(*arrays):
         ix[:, n] = arrays[n][ix[:, n]]
     return ix
 
-def hstack(value):
-    return np.asarray(value).T if len(value)>1 else value[0]
+def _has_nan(key):
+    kind = key.dtype.kind
+    return (kind in 'fc' and np.isnan(key).any()) or (kind in 'mM' and np.isnat(key).any())
+
+def _is_presortable(keys):
+    """
+    presorted joins only run natively on typed, nan-free key columns
+    """
+    return all(key.dtype != np.dtype('O') and key.ndim == 1 and not _has_nan(key) for key in keys)
+
+def _is_sorted(keys):
+    """
+    a linear check that the rows of keys, a list of columns, are in non-decreasing lexicographic order
+    >>> assert _is_sorted([np.array([1,1,2]), np.array([3,4,0])])
+    >>> assert not _is_sorted([np.array([1,1,2]), np.array([4,3,0])])
+    """
+    if not keys or len(keys[0]) < 2:
+        return True
+    undecided = np.ones(len(keys[0]) - 1, dtype = bool)
+    for key in keys:
+        if (undecided & (key[:-1] > key[1:])).any():
+            return False
+        undecided &= key[:-1] == key[1:]
+    return True
+
+def _group_starts(keys):
+    """
+    for sorted keys, returns the positions at which a new group of equal keys starts
+    """
+    n = len(keys[0])
+    change = np.zeros(n, dtype = bool)
+    change[:1] = True
+    for key in keys:
+        change[1:] |= key[1:] != key[:-1]
+    return np.flatnonzero(change)
+
+_NAN = object() ## stands in for nan in hashed keys, as nan != nan
+
+def _hashable_keys(key):
+    """
+    converts a key column into values that can be hashed and tested for membership, with all nans treated as equal, as Sort does
+    """
+    if key.dtype.kind in 'fc':
+        isnan = np.isnan(key)
+        if isnan.any():
+            key = key.astype(object)
+            key[isnan] = _NAN
+        return key.tolist()
+    elif key.dtype == np.dtype('O'):
+        return [_NAN if isinstance(v, float) and v != v else v for v in key]
+    return key.tolist()
+
+def _isin(lhs, rhs):
+    """
+    returns a boolean mask of the rows of lhs, a list of key columns, whose keys appear in rhs
+    >>> assert list(_isin([np.array([1,2,3])], [np.array([3,1])])) == [True, False, True]
+    >>> assert list(_isin([np.array([1.,np.nan]), np.array(['a','b'])], [np.array([np.nan]), np.array(['b'])])) == [False, True]
+    """
+    if len(lhs) == 1:
+        l, r = lhs[0], rhs[0]
+        numeric = l.dtype.kind in 'biuf' and r.dtype.kind in 'biuf'
+        if l.ndim == 1 and r.ndim == 1 and (numeric or (l.dtype.kind == r.dtype.kind and l.dtype.kind in 'USmM')) and not _has_nan(l) and not _has_nan(r):
+            return np.isin(l, r)
+        keys = set(_hashable_keys(r))
+        return np.fromiter(map(keys.__contains__, _hashable_keys(l)), dtype = bool, count = len(l))
+    keys = set(zip(*map(_hashable_keys, rhs)))
+    return np.fromiter(map(keys.__contains__, zip(*map(_hashable_keys, lhs))), dtype = bool, count = len(lhs[0]))
+
+def _ranges(starts, counts):
+    """
+    concatenates the ranges [start, start + count) in one go
+    >>> assert list(_ranges(np.array([5, 0, 2]), np.array([2, 0, 3]))) == [5, 6, 2, 3, 4]
+    """
+    counts = np.asarray(counts, dtype = int)
+    return np.repeat(np.asarray(starts, dtype = int) - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+
+def _flatten_groups(groups):
+    """
+    groups is a column of index arrays (2-d if all are the same length). returns the concatenated indices and the length of each group
+    """
+    if groups.dtype != np.dtype('O') and groups.ndim == 2:
+        return groups.ravel().astype(int), np.full(groups.shape[0], groups.shape[1], dtype = int)
+    lens = np.fromiter(map(len, groups), dtype = int, count = len(groups))
+    flat = np.concatenate([np.asarray(g, dtype = int) for g in groups]) if lens.sum() else np.array([], dtype = int)
+    return flat, lens
+
+def _cartesian_ranges(lhs_starts, lhs_lens, rhs_starts, rhs_lens, max_rows = None):
+    """
+    For each i, the cartesian product of the ranges [lhs_starts[i], lhs_starts[i] + lhs_lens[i]) and [rhs_starts[i], rhs_starts[i] + rhs_lens[i]), concatenated.
+    Raises a ValueError before allocating anything if there would be more than max_rows pairs.
+    >>> lhs_idx, rhs_idx = _cartesian_ranges(np.array([0, 2]), np.array([2, 1]), np.array([5, 6]), np.array([1, 2]))
+    >>> assert list(lhs_idx) == [0, 1, 2, 2] and list(rhs_idx) == [5, 5, 6, 7]
+    """
+    sizes = lhs_lens * rhs_lens
+    total = int(sizes.sum())
+    if max_rows is not None and total > max_rows:
+        raise ValueError('join would create %i rows, more than max_rows=%i'%(total, max_rows))
+    group = np.repeat(np.arange(len(sizes)), sizes)
+    within = _ranges(np.zeros(len(sizes), dtype = int), sizes)
+    width = np.maximum(rhs_lens[group], 1)
+    return lhs_starts[group] + within // width, rhs_starts[group] + within % width
+
+def cartesian_pairs(lhs_groups, rhs_groups, max_rows = None):
+    """
+    For each pair of groups, the cartesian product of lhs_groups[i] and rhs_groups[i], concatenated and computed without a loop over the groups.
+    Within each group, the order matches cartesian. Raises a ValueError before allocating anything if there would be more than max_rows pairs.
+    
+    >>> lhs_idx, rhs_idx = cartesian_pairs(as_ndarray([[0, 1], [2]]), as_ndarray([[5], [6, 7]]))
+    >>> assert list(lhs_idx) == [0, 1, 2, 2] and list(rhs_idx) == [5, 5, 6, 7]
+    """
+    lhs_flat, lhs_lens = _flatten_groups(lhs_groups)
+    rhs_flat, rhs_lens = _flatten_groups(rhs_groups)
+    lhs_idx, rhs_idx = _cartesian_ranges(np.cumsum(lhs_lens) - lhs_lens, lhs_lens, np.cumsum(rhs_lens) - rhs_lens, rhs_lens, max_rows)
+    return lhs_flat[lhs_idx], rhs_flat[rhs_idx]
+
+def _split(flat, lens):
+    """
+    splits flat into consecutive groups of length lens
+    """
+    return nplist(np.split(flat, np.cumsum(lens)[:-1])) if len(lens) else nplist()
+
+_categorical = ('category', 'categorical')
+
+def _schema_dtype(dtype):
+    return np.dtype('O') if isinstance(dtype, str) and dtype in _categorical else np.dtype(dtype)
+
+def _missing(dtype):
+    """
+    the value used to fill a typed column for rows of a table that does not have it
+    """
+    if dtype.kind in 'fc':
+        return np.nan
+    elif dtype.kind in 'mM':
+        return np.datetime64('NaT') if dtype.kind == 'M' else np.timedelta64('NaT')
+    elif dtype.kind == 'O':
+        return None
+    raise ValueError('cannot fill missing values in a column of type %s'%dtype)
+
+def as_schema_array(value, dtype, key = None):
+    """
+    casts a column, in one go, to the dtype set for it by a Dictable schema. 
+    dtype is anything np.dtype accepts, or 'category', for an object column in which equal values share a single object.
+
+    >>> assert as_schema_array([1, 2], float).dtype == np.float64
+    >>> x = as_schema_array(['a' * 10] * 3, 'category')
+    >>> assert x.dtype == np.dtype('O') and x[0] is x[2]
+    """
+    if isinstance(dtype, str) and dtype in _categorical:
+        values = as_ndarray(value)
+        categories = {}
+        res = np.empty(len(values), dtype = object)
+        try:
+            res[:] = [categories.setdefault(v, v) for v in values]
+        except TypeError as e:
+            raise ValueError('column %s cannot be cast to %s: %s'%(key, dtype, e))
+        return res
+    try:
+        return as_ndarray(value, np.dtype(dtype))
+    except (TypeError, ValueError) as e:
+        raise ValueError('column %s cannot be cast to %s: %s'%(key, dtype, e))
 
 vstack = concat
 
@@ -47,7 +203,35 @@ class Dictable(Dict):
     In addition, we support "table" operations such as join/sort/filter table and 2-d access
     t = Dictable(a = [1,2,3])
     
+    A Dictable class can carry a schema, a dict of column to dtype (see as_schema_array). Columns in the schema are cast once, in bulk, 
+    on construction, on __setitem__ and on concat, rather than having their type inferred. Since operations create type(self), derived tables keep it:
+    
+    >>> class Trades(Dictable):
+    >>>     _schema = dict(qty = float, name = 'category')
+    >>> t = Trades(qty = [1, 2], name = 'a')
+    >>> assert t.qty.dtype == np.float64 and type(t.take([0])) == Trades
+    
+    The schema is held in _schema so that it does not hide a column called 'schema' from attribute access. 
+    Rows taken from a table (take, filter, sort...) are already cast, so they are not cast again.
     """
+    _schema = None
+
+    @classmethod
+    def with_schema(cls, schema = None, **dtypes):
+        """
+        returns a subclass of cls with schema (added to cls._schema). As with any class created on the fly, its tables do not pickle, so prefer declaring a subclass.
+        >>> Trades = Dictable.with_schema(qty = float)
+        >>> assert Trades(qty = [1, 2]).qty.dtype == np.float64
+        """
+        schema = dict(cls._schema or {}, **(schema or {}), **dtypes)
+        return type(cls.__name__, (cls,), dict(_schema = schema))
+
+    def _cast(self, key, value):
+        schema = self._schema
+        if schema and key in schema:
+            return as_schema_array(value, schema[key], key)
+        return as_ndarray(value)
+
     def __init__(self, data=None, columns=None, **kwargs):
         """
         >>> d = Dictable(a = [1,2,3], b=2, c=[3,4,6])
@@ -60,10 +244,11 @@ class Dictable(Dict):
         kwargs.update(data_and_columns_to_dict(data,columns))
         super(Dictable, self).__init__(kwargs)
         for key, value in self.items():
-            super(Dictable, self).__setitem__(key, as_ndarray(value))
+            super(Dictable, self).__setitem__(key, self._cast(key, value))
         n = len(self)
         for key, value in self.items():
-            self.__setitem__(key, value, n)
+            if len(value) != n:
+                self.__setitem__(key, value, n)
 
     def __len__(self):
         """
@@ -97,11 +282,11 @@ class Dictable(Dict):
             yield self[i]
             
     def _bool2mask(self, mask, exc = False, check_bool=True):
-        if check_bool and (hasattr(mask, '__next__ ') or hasattr(mask, '__iter__')) and not isinstance(mask, str) and hasattr(mask, '__len__') and len(mask) == len(self) and min([isinstance(i, bool) or i in [0,1] for i in mask]):
-            mask = np.array(mask)
+        if check_bool and _is_bool_mask(mask, len(self)):
+            mask = np.asarray(mask, dtype = bool)
             if exc:
                 mask = ~mask
-            return np.arange(len(self))[mask]
+            return np.flatnonzero(mask)
         else:
             return as_ndarray(mask)
 
@@ -135,10 +320,42 @@ class Dictable(Dict):
                 index[mask] = False
                 mask = index
         else:
-            mask = self._bool2mask(mask, check_bool, exc)
+            mask = self._bool2mask(mask, exc = exc, check_bool = check_bool)
             if exc and len(mask) == 0: ## include everything, as mask be ufunc invert
                 return self 
-        return type(self)({key : value[mask] for key, value in self.items()})
+        return self._rows(mask)
+
+    def _rows(self, index):
+        """
+        the table of the rows at index. The columns of self are already cast to the schema, so we bypass __init__ rather than cast them again
+        """
+        res = type(self).__new__(type(self))
+        dict.update(res, {key : value[index] for key, value in self.items()})
+        return res
+
+    def take(self, indices):
+        """
+        resamples the table by integer indices. Unlike _mask, we never try to guess if indices is a boolean mask
+        >>> d = Dictable(a = [1,2])
+        >>> assert list(d.take([0,1]).a) == [1,2]
+        >>> assert list(d.take([1,1,0]).a) == [2,2,1]
+        """
+        indices = np.asarray(indices, dtype = int)
+        return self._rows(indices)
+    
+    def filter(self, mask, exc = False):
+        """
+        filters the table using a boolean mask of the same length as the table
+        >>> d = Dictable(a = [1,2])
+        >>> assert list(d.filter([0,1]).a) == [2]
+        >>> assert list(d.filter([0,1], exc = True).a) == [1]
+        """
+        mask = np.asarray(mask, dtype = bool)
+        if len(mask) != len(self):
+            raise ValueError('cannot filter a table of size %s with a mask of size %s'%(len(self), len(mask)))
+        if exc:
+            mask = ~mask
+        return self.take(np.flatnonzero(mask))
 
     def _subset(self, mask):
         """
@@ -188,23 +405,26 @@ class Dictable(Dict):
         >>> d['path','file'] = d[lambda fn: [_ for _ in fn.split('/') if _]]
 
         """
-        value = as_ndarray(value)
+        value = as_ndarray(value) if isinstance(key, tuple) else self._cast(key, value)
         n = n or len(self)
-        if len(value)==n or len(self.keys()) == 0:
+        if len(value)==n or super(Dictable, self).__len__() == 0:
             pass
         elif len(value)== 1:
             value = value * n if isinstance(value, list) else np.concatenate([value] * n)
         else:
             raise ValueError('cannot set item of mismatched length %s to array of size %s'%(len(value), n))
         if isinstance(key, tuple):
+            schema = self._schema or {}
             for k, v in zip(key, zip(*value)):
-                super(Dictable, self).__setitem__(k, v)
+                super(Dictable, self).__setitem__(k, as_schema_array(v, schema[k], k) if k in schema else v)
         else:
             super(Dictable, self).__setitem__(key, value)
 
     def _vectorize(self, function, relabels=None):
         """
         This function try to line-by-line running 
+        If the function lists its positional args (see support_kwargs), we zip only the columns it needs and call it positionally, 
+        otherwise we build a dict of parameters per row.
         >>> d = Dictable(a = [1,2,3,4,5])
         >>> d.b = d[lambda a: range(a)]
         >>> vsum = d._vectorize(sum)
@@ -214,7 +434,14 @@ class Dictable(Dict):
         >>>     sum(d.b)
         >>> assert np.allclose(vsum(d.b), [0,1,3,6,10]) ## triangular functions        
         """
+        positional = getattr(function, 'positional', None)
         def wrapped(*args, **parameters):
+            if positional is not None and set(positional[len(args):]) <= parameters.keys():
+                values = list(args) + [parameters[key] for key in positional[len(args):]]
+                if len(values):
+                    return [function(*row) for row in args_zip(*values)]
+                else:
+                    return [function() for _ in range(args_len(*parameters.values()))] if parameters else []
             args_ = list(args_zip(*args))
             kwargs_ = dict_zip(parameters)
             if len(args_)>0 and len(kwargs_)>0:
@@ -337,12 +564,19 @@ class Dictable(Dict):
         >>> res = Dictable.concat(*others)
         >>> assert list(res.d) == [None] * 2 + ['hi'] * 3  
         >>> assert list(res.c) == [1] * 2 + [None] * 3        
+
+        With a schema, each table is cast first so typed columns are concatenated natively, and missing typed columns are filled with nan/NaT
         """
         others = args_to_list(others)
         others = [cls(other) for other in others]
-        concated = dict_concat(others)
-        merged = dict_apply(concated, concat)
-        return cls(merged)
+        if cls._schema:
+            keys = slist(key for other in others for key in other.keys())
+            dtypes = {key : _schema_dtype(cls._schema[key]) for key in keys if key in cls._schema}
+            typed = {key : np.concatenate([other[key] if key in other else np.full(len(other), _missing(dtype), dtype = dtype) for other in others]) 
+                     for key, dtype in dtypes.items()}
+            untyped = dict_merge(others, 'c', dict_type = dict, keys = [key for key in keys if key not in dtypes], columnar = True)
+            return cls({key : typed[key] if key in typed else untyped[key] for key in keys})
+        return cls(dict_merge(others, 'c', dict_type = dict, columnar = True))
 
     def __add__(self, other):
         """
@@ -355,7 +589,7 @@ class Dictable(Dict):
         >>> assert sorted(z.keys()) == ['a','b','c']
         >>> assert list(z.a) == [1,2,3,1,2,3] and list(z.c) == [None, None, None, 4, 5, 6] and list(z.b) == [4, 5, 6, None, None, None]
         """
-        return Dictable.concat(self, other)
+        return type(self).concat(self, other)
         
     def __sub__(self, other):
         return Dictable({key : value for key, value in self.items() if key not in as_list(other)})
@@ -363,6 +597,7 @@ class Dictable(Dict):
     def PrettyTable(self, *args, **kwargs):
         if len(self) == 0:
             return self.keys() ## pretty table does not print column names if there are no rows.
+        from prettytable import PrettyTable
         x = PrettyTable(*args, **kwargs)
         x.field_names = self.keys()
         for row in self:
@@ -380,11 +615,14 @@ class Dictable(Dict):
     def __repr__(self):
         return 'Dictable[%s x %s] '%self.shape + '\n%s'%self.__str__(5)
     
-    def _Sort(self, *keys):
-        return Sort([self[key] for key in args_to_list(keys)])
+    def _Sort(self, *keys, ascending = True):
+        return Sort([self[key] for key in args_to_list(keys)], ascending = ascending)
 
-    def sort(self, *by):
+    def sort(self, *by, limit = None, ascending = True):
         """
+        sorts the table by the columns/functions in by. If limit is provided, only the first limit rows are returned, without a full sort.
+        ascending is either a bool or a list of bools, one per key in by.
+
         >>> from mombai import *
         >>> import numpy as np
         >>> d = Dictable(a = [_ for _ in 'abracadabra'], b=range(11), c = range(0,33,3))
@@ -398,8 +636,32 @@ class Dictable(Dict):
         
         >>> d = d.sort(lambda b: b*3 % 11) ## sorting again by c but using a function
         >>> assert list(d.c) == list(range(11))
+        >>> assert list(d.sort('c', limit = 3).c) == [0,1,2]
+        >>> assert list(d.sort('c', ascending = False).c) == list(range(10,-1,-1))
+        """
+        idx = self._Sort(*by, ascending = ascending)
+        if limit is not None:
+            return self.take(idx.top(limit))
+        return idx.sort(self)
+
+    def nsmallest(self, n, *by):
+        """
+        returns the n rows that come first when sorting by the columns/functions in by, in sort order. 
+        Uses np.argpartition for typed columns and a heap for object columns rather than a full sort.
+
+        >>> d = Dictable(a = [3,1,2,1,5], b = range(5))
+        >>> assert list(d.nsmallest(2, 'a').b) == [1,3]
         """
-        return self._Sort(*by).sort(self)
+        return self.take(self._Sort(*by).top(n))
+
+    def nlargest(self, n, *by):
+        """
+        returns the n rows that come last when sorting by the columns/functions in by, largest first. Ties are kept in their original order.
+
+        >>> d = Dictable(a = [3,1,2,1,5], b = range(5))
+        >>> assert list(d.nlargest(2, 'a').b) == [4,0]
+        """
+        return self.take(self._Sort(*by).top(n, largest = True))
 
     def listby(self, *by, **kwargs):
         """
@@ -573,11 +835,60 @@ class Dictable(Dict):
         res = res(lhs_idx = lambda idx: idx[idx<lhs_len])(rhs_idx = lambda idx: idx[idx>=lhs_len]-lhs_len)
         res = res(lhs_len = lambda lhs_idx: len(lhs_idx))(rhs_len = lambda rhs_idx: len(rhs_idx))
         return res
+
+    def _presorted_groups(self, other, on_left, on_right):
+        """
+        for tables whose (typed) key columns are already sorted, the groups of rows of self and other sharing each distinct key, in key order.
+        Sorted groups are contiguous, so each group is a range and we return the arrays (lhs_starts, lhs_lens, rhs_starts, rhs_lens), one entry per distinct key.
+        Only the distinct keys of the two sides are merged and there is no loop over the groups.
+        returns None if the keys are not sorted, so that the caller can fall back to pair
+        """
+        lhs = [as_ndarray(self[key]) for key in on_left]
+        rhs = [as_ndarray(other[key]) for key in on_right]
+        lhs_len, rhs_len = len(self), len(other)
+        if not lhs or lhs_len == 0 or rhs_len == 0 or not _is_presortable(lhs + rhs) or not _is_sorted(lhs) or not _is_sorted(rhs):
+            return None
+        lhs_starts, rhs_starts = _group_starts(lhs), _group_starts(rhs)
+        lhs_lens = np.diff(np.append(lhs_starts, lhs_len))
+        rhs_lens = np.diff(np.append(rhs_starts, rhs_len))
+        keys = [np.concatenate([l[lhs_starts], r[rhs_starts]]) for l, r in zip(lhs, rhs)]
+        order = np.lexsort(keys[::-1]) ## each side is sorted and distinct, so a key has at most one group per side, the lhs group first
+        new = np.zeros(len(order), dtype = bool)
+        new[0] = True
+        for key in keys:
+            key = key[order]
+            new[1:] |= key[1:] != key[:-1]
+        block_starts = np.flatnonzero(new)
+        first = order[block_starts]
+        last = order[np.append(block_starts[1:], len(order)) - 1]
+        n = len(lhs_starts)
+        has_lhs, has_rhs = first < n, last >= n
+        lhs_group, rhs_group = np.minimum(first, n - 1), np.maximum(last - n, 0)
+        return (np.where(has_lhs, lhs_starts[lhs_group], 0), np.where(has_lhs, lhs_lens[lhs_group], 0), 
+                np.where(has_rhs, rhs_starts[rhs_group], 0), np.where(has_rhs, rhs_lens[rhs_group], 0))
+
+    def _presorted_pair(self, other, on_left, on_right):
+        """
+        same as pair, for tables whose (typed) key columns are already sorted (see _presorted_groups). returns None if they are not
+
+        >>> lhs = Dictable(a = [1,1,2,4], b = range(4))
+        >>> rhs = Dictable(a = [1,3,4,4], c = range(4))
+        >>> res = lhs._presorted_pair(rhs, ['a'], ['a'])
+        >>> assert list(map(list, res.lhs_idx)) == [[0,1], [2], [], [3]] and list(map(list, res.rhs_idx)) == [[0], [], [1], [2,3]]
+        """
+        groups = self._presorted_groups(other, on_left, on_right)
+        if groups is None:
+            return None
+        lhs_starts, lhs_lens, rhs_starts, rhs_lens = groups
+        idx = _ranges(np.stack([lhs_starts, rhs_starts + len(self)], 1).ravel(), np.stack([lhs_lens, rhs_lens], 1).ravel())
+        return Dictable(idx = _split(idx, lhs_lens + rhs_lens), 
+                        lhs_idx = _split(_ranges(lhs_starts, lhs_lens), lhs_lens), rhs_idx = _split(_ranges(rhs_starts, rhs_lens), rhs_lens), 
+                        lhs_len = lhs_lens, rhs_len = rhs_lens)
     
-    def _join(self, pair, other, on_left, on_right, merge='a'):
+    def _join(self, pair, other, on_left, on_right, merge='a', max_rows=None):
         """
         This function takes a pairing and then performs several actions:
-        1) resample each pair into a cartesian product
+        1) resample each pair into a cartesian product, for all pairs at once using cartesian_pairs. If this exceeds max_rows, we raise a ValueError
         2) resample using _mask each of self and other into two equal length tables
         3) merge the two tables using dict_merge. Here we pair together any columns that repeat on both self and other, with the exception of columns involved in the join the on_left/on_right that we know are identical
         >>> from mombai import *
@@ -588,25 +899,34 @@ class Dictable(Dict):
         >>> assert list(map(list, res.a)) == [[1, 4], [2, 3], [3, 2], [4, 1]]
         >>> assert set(res.d) == {'d'} and set(res.e) == {'e'}       
         """
-        res = pair.exc(rhs_len=0).exc(lhs_len=0)
-        res = res(pairs = lambda lhs_idx, rhs_idx: cartesian(lhs_idx, rhs_idx))
-        lhs_idx, rhs_idx = np.concatenate(res.pairs).T
-        dicts = [self._mask(lhs_idx, check_bool = False), other._mask(rhs_idx, check_bool = False)]
+        lhs_idx, rhs_idx = cartesian_pairs(pair.lhs_idx, pair.rhs_idx, max_rows)
+        return self._merge_rows(other, lhs_idx, rhs_idx, on_left, on_right, merge)
+
+    def _merge_rows(self, other, lhs_idx, rhs_idx, on_left, on_right, merge='a'):
+        """
+        merges the rows lhs_idx of self with the rows rhs_idx of other using dict_merge.
+        The two tables are row-aligned so, as with 'append', 'concat' pairs the columns side by side: each becomes n x 2, with None where a table does not have it.
+        """
+        dicts = [self.take(lhs_idx), other.take(rhs_idx)]
         duplicate_columns = [left for left, right in zip(on_left, on_right) if left==right and left in self]
-        merged = dict_merge(dicts, policy = merge, dict_type = dict, policies = {col : 'left' for col in duplicate_columns})
-        return type(self)(dict_apply(merged, hstack, {col : None for col in duplicate_columns}))
+        policies = {col : 'left' for col in duplicate_columns}
+        if isinstance(merge, str) and merge[:1].lower() == 'c':
+            fill = np.full(len(lhs_idx), None, dtype = object)
+            merged = dict_merge(dicts, policy = merge, dict_type = dict, policies = policies)
+            return type(self)({key : value if key in policies else hstack([fill if v is None else v for v in value]) for key, value in merged.items()})
+        return type(self)(dict_merge(dicts, policy = merge, dict_type = dict, policies = policies, columnar = True))
 
     def _left_xor(self, pair, other):
         res = pair.inc(rhs_len=0).exc(lhs_len=0)
         lhs_idx = sorted(concat(res.lhs_idx))
-        return self._mask(lhs_idx, check_bool = False)
+        return self.take(lhs_idx)
 
     def _right_xor(self, pair, other):
         res = pair.exc(rhs_len=0).inc(lhs_len=0)
         rhs_idx = sorted(concat(res.rhs_idx))
-        return other._mask(rhs_idx, check_bool = False)
+        return other.take(rhs_idx)
 
-    def merge(self, other, on_left=None, on_right=None, merge='a'):
+    def merge(self, other, on_left=None, on_right=None, merge='a', presorted=False, max_rows=None):
         """
         Dictable.merge is similar to pd.merge we perform an inner join based on on_left and on_right
         Unlike pandas.merge, on_left and on_right need not be actual columns:
@@ -631,6 +951,14 @@ class Dictable(Dict):
             2) subsets selection/cartesian product from the two tables
             3) dict_merge of the two subsets
 
+        max_rows guards against keys with heavy duplication: we raise a ValueError, before materialising anything, if the join would have more rows.
+
+        If both tables are already sorted by their (typed) keys, presorted=True replaces the sort in step 1 with a linear merge.
+        The sort order is checked first and, if it does not hold, we fall back to sorting.
+        >>> lhs = Dictable(a = [1,2,2,3], b = range(4))
+        >>> rhs = Dictable(a = [2,3,5], c = range(3))
+        >>> assert lhs.merge(rhs, 'a', presorted = True) == lhs.merge(rhs, 'a')
+
         self = Dictable(a = range(3))
         other = Dictable(a = range(3,6))
         c = self.merge(other, on_left = [])
@@ -640,12 +968,190 @@ class Dictable(Dict):
         if len(on_left) == 0:
             pair = Dictable(idx = [np.arange(len(self) + len(other))], lhs_idx = [np.arange(len(self))], rhs_idx = [np.arange(len(other))], lhs_len = len(self), rhs_len = len(other))
         else:
+            groups = self._presorted_groups(other, on_left, on_right) if presorted else None
+            if groups is not None:
+                lhs_idx, rhs_idx = _cartesian_ranges(*groups, max_rows = max_rows)
+                return self._merge_rows(other, lhs_idx, rhs_idx, on_left, on_right, merge)
             pair = self.pair(other, on_left, on_right)
-        return self._join(pair, other, on_left, on_right, merge)
+        return self._join(pair, other, on_left, on_right, merge, max_rows)
+
+    def asof_merge(self, other, on_left=None, on_right=None, merge='a'):
+        """
+        as-of merge: each row of self is matched to the last row of other whose key is at or before its own key. 
+        Rows of self with no such row in other are dropped, as in merge.
+        on_left/on_right are a single (typed) key, which may have different names in self and other. 
+        This is asof_join, without by keys and in the backward direction.
+        When the key appears in both tables, self's value is kept.
+
+        >>> trades = Dictable(date = [2, 5, 7], qty = [10, 20, 30])
+        >>> quotes = Dictable(date = [1, 3, 5, 8], px = [100, 101, 102, 103])
+        >>> res = trades.asof_merge(quotes, 'date')
+        >>> assert list(res.date) == [2, 5, 7] and list(res.px) == [100, 102, 102]
+        """
+        other = type(self)(other)
+        on_left, on_right = self._on_left_and_on_right(other, on_left, on_right)
+        if len(on_left) != 1 or len(on_right) != 1:
+            raise ValueError('asof_merge joins on exactly one key, got %s and %s'%(on_left, on_right))
+        return self._asof(other, on_left[0], on_right[0], merge = merge)
     
+    def _by_groups(self, other, by):
+        """
+        returns a list of (lhs_idx, rhs_idx) of the rows in self and other that share the same by keys
+        """
+        if not by:
+            return [(np.arange(len(self)), np.arange(len(other)))]
+        pair = self.pair(other, by, by).exc(lhs_len=0).exc(rhs_len=0)
+        return [(np.asarray(lhs_idx, dtype = int), np.asarray(rhs_idx, dtype = int)) for lhs_idx, rhs_idx in zip(pair.lhs_idx, pair.rhs_idx)]
+
+    def _merge_groups(self, other, matches, on_left, on_right, merge='a'):
+        """
+        matches is a list of (lhs_idx, rhs_idx) of matched rows. We merge them, keeping the order of self.
+        """
+        if matches:
+            lhs_idx = np.concatenate([lhs for lhs, _ in matches]).astype(int)
+            rhs_idx = np.concatenate([rhs for _, rhs in matches]).astype(int)
+        else:
+            lhs_idx = rhs_idx = np.array([], dtype = int)
+        order = np.argsort(lhs_idx, kind = 'stable')
+        return self._merge_rows(other, lhs_idx[order], rhs_idx[order], on_left, on_right, merge)
+
+    def asof_join(self, other, on, by=None, tolerance=None, direction='backward', merge='a'):
+        """
+        as-of join: each row of self is matched, within rows of other that share the same by keys, to a single row of other:
+        
+        - backward: the last row whose on key is at or before its own
+        - forward: the first row whose on key is at or after its own
+        - nearest: the closest of the two, preferring backward on ties
+        
+        on is a single column, which may be given as a one-element list.
+        If tolerance is provided, matches further than tolerance away are dropped. Like merge, unmatched rows of self are dropped.
+        Each group of other is sorted once and all rows of self are then matched using np.searchsorted.
+
+        >>> trades = Dictable(date = [2, 5, 7, 2], instrument = ['a', 'a', 'a', 'b'], qty = [10, 20, 30, 40])
+        >>> quotes = Dictable(date = [1, 3, 5, 8, 1], instrument = ['a', 'a', 'a', 'a', 'b'], px = [100, 101, 102, 103, 50])
+        >>> res = trades.asof_join(quotes, 'date', by = 'instrument')
+        >>> assert list(res.px) == [100, 102, 102, 50]
+        >>> res = trades.asof_join(quotes, 'date', by = 'instrument', direction = 'forward')
+        >>> assert list(res.px) == [101, 102, 103]
+        >>> res = trades.asof_join(quotes, 'date', by = 'instrument', tolerance = 0)
+        >>> assert list(res.qty) == [20]
+        """
+        on = as_list(on)
+        if len(on) != 1:
+            raise ValueError('asof_join joins on exactly one key, got %s'%on)
+        return self._asof(other, on[0], on[0], by, tolerance, direction, merge)
+
+    def _asof(self, other, on_left, on_right, by=None, tolerance=None, direction='backward', merge='a'):
+        """
+        the as-of matching of asof_join and asof_merge, with on_left and on_right single column names
+        """
+        if direction not in ('backward', 'forward', 'nearest'):
+            raise ValueError("direction must be one of 'backward', 'forward' or 'nearest', got %s"%direction)
+        other = type(self)(other)
+        by = as_list(by)
+        lhs, rhs = as_ndarray(self[on_left]), as_ndarray(other[on_right])
+        if _has_nan(lhs) or _has_nan(rhs):
+            raise ValueError('as-of joins do not support nan keys')
+        matches = []
+        for lhs_idx, rhs_idx in self._by_groups(other, by):
+            if len(rhs_idx) == 0:
+                continue
+            if not _is_sorted([rhs[rhs_idx]]):
+                rhs_idx = rhs_idx[np.argsort(rhs[rhs_idx], kind = 'stable')]
+            keys = rhs[rhs_idx]
+            values = lhs[lhs_idx]
+            backward = np.searchsorted(keys, values, side = 'right') - 1
+            forward = np.searchsorted(keys, values, side = 'left')
+            if direction == 'backward':
+                pos = backward
+            elif direction == 'forward':
+                pos = np.where(forward < len(keys), forward, -1)
+            else:
+                has_back = backward >= 0
+                has_fwd = forward < len(keys)
+                back_dist = np.where(has_back, np.abs(values - keys[np.maximum(backward, 0)]), 0)
+                fwd_dist = np.where(has_fwd, np.abs(keys[np.minimum(forward, len(keys) - 1)] - values), 0)
+                use_fwd = has_fwd & (~has_back | (fwd_dist < back_dist))
+                pos = np.where(use_fwd, forward, np.where(has_back, backward, -1))
+            found = pos >= 0
+            if tolerance is not None:
+                found[found] = np.abs(values[found] - keys[pos[found]]) <= tolerance
+            matches.append((lhs_idx[found], rhs_idx[pos[found]]))
+        return self._merge_groups(other, matches, by + [on_left], by + [on_right], merge)
+
+    def between_join(self, other, left, start='start', end='end', by=None, merge='a', max_rows=None):
+        """
+        range join: each row of self is matched to every row of other (sharing the same by keys) with other[start] <= self[left] <= other[end].
+
+        Each group of other is sorted by start once. If, in that order, end is non-decreasing too (e.g. non-overlapping periods), 
+        the matches of each row are a contiguous range found with two np.searchsorted calls. Otherwise we filter the rows that have started by their end.
+        As in merge, max_rows guards against overlapping ranges exploding the join: we raise a ValueError as soon as the matches exceed it.
+
+        >>> trades = Dictable(date = [2, 5, 9])
+        >>> periods = Dictable(start = [0, 4, 5], end = [4, 8, 6], period = ['q1', 'q2', 'x'])
+        >>> res = trades.between_join(periods, 'date')
+        >>> assert list(res.date) == [2, 5, 5] and list(res.period) == ['q1', 'q2', 'x']
+        """
+        other = type(self)(other)
+        by = as_list(by)
+        values, starts, ends = as_ndarray(self[left]), as_ndarray(other[start]), as_ndarray(other[end])
+        matches = []
+        total = 0
+        def check(n):
+            if max_rows is not None and total + n > max_rows:
+                raise ValueError('join would create more than max_rows=%i rows'%max_rows)
+            return total + n
+        for lhs_idx, rhs_idx in self._by_groups(other, by):
+            rhs_idx = rhs_idx[np.argsort(starts[rhs_idx], kind = 'stable')]
+            s, e, v = starts[rhs_idx], ends[rhs_idx], values[lhs_idx]
+            hi = np.searchsorted(s, v, side = 'right') ## rows [0, hi) have started
+            if _is_sorted([e]):
+                lo = np.searchsorted(e, v, side = 'left') ## rows [lo, ...) have not ended
+                counts = np.maximum(hi - lo, 0)
+                total = check(counts.sum())
+                matches.append((np.repeat(lhs_idx, counts), rhs_idx[_ranges(lo, counts)]))
+            else:
+                for i, n, value in zip(lhs_idx, hi, v):
+                    rhs = rhs_idx[:n][~(e[:n] < value)]
+                    total = check(len(rhs))
+                    matches.append((np.full(len(rhs), i, dtype = int), rhs))
+        return self._merge_groups(other, matches, by + as_list(left), by + as_list(start), merge)
+
     def __mul__(self, other):
         return self.merge(other)
         
+    def isin(self, other, on_left=None, on_right=None):
+        """
+        returns a boolean mask of the rows of self whose keys appear in other. 
+        This is a membership test against a set of the keys of other: no sorting and no pairing of rows.
+        Keys that cannot be hashed (e.g. arrays) fall back to pair. 
+        >>> students = Dictable(name = ['Adam', 'Beth', 'Eve'])
+        >>> lunch = Dictable(name = ['Adam','Eve'], lunch = ['Bread', 'Apple'])
+        >>> assert list(students.isin(lunch)) == [True, False, True]
+        """
+        other = type(self)(other)
+        on_left, on_right = self._on_left_and_on_right(other, on_left, on_right)
+        if not on_left and not on_right:
+            return np.full(len(self), len(other) > 0)
+        lhs = [as_ndarray(self[key]) for key in on_left]
+        rhs = [as_ndarray(other[key]) for key in on_right]
+        try:
+            return _isin(lhs, rhs)
+        except TypeError:
+            pair = self.pair(other, on_left, on_right).exc(rhs_len = 0).exc(lhs_len = 0)
+            mask = np.zeros(len(self), dtype = bool)
+            mask[np.asarray(concat(pair.lhs_idx), dtype = int)] = True
+            return mask
+
+    def semi_join(self, other, on_left=None, on_right=None):
+        """
+        returns the rows of self that have a match in other, once each and in their original order, without any of other's columns
+        >>> students = Dictable(name = ['Adam', 'Beth', 'Eve'])
+        >>> lunch = Dictable(name = ['Adam','Eve', 'Eve'], lunch = ['Bread', 'Apple', 'Pear'])
+        >>> assert eq(students.semi_join(lunch), Dictable(name = ['Adam', 'Eve']))
+        """
+        return self.filter(self.isin(other, on_left, on_right))
+
     def xor(self, other, on_left=None, on_right=None):
         """
         xor is an extremely useful function as, unlike left join, it tells us which original records we have not been able to match in other
@@ -658,8 +1164,7 @@ class Dictable(Dict):
         on_left, on_right = self._on_left_and_on_right(other, on_left, on_right)
         if not on_left and not on_right:
             return self
-        pair = self.pair(other, on_left, on_right)
-        return self._left_xor(pair, other)
+        return self.filter(~self.isin(other, on_left, on_right))
 
     def __truediv__(self, other):
         return self.xor(other)
@@ -669,8 +1174,7 @@ class Dictable(Dict):
         on_left, on_right = self._on_left_and_on_right(other, on_left, on_right)
         if not on_left and not on_right:
             return other
-        pair = self.pair(other, on_left, on_right)
-        return self._right_xor(pair, other)
+        return other.filter(~other.isin(self, on_right, on_left))
 
     def left_join(self, other, on_left=None, on_right=None):
         other = type(self)(other)
@@ -682,6 +1186,16 @@ class Dictable(Dict):
         pair = self.pair(other, on_left, on_right)
         return self._join(pair, other) + self._right_xor(pair, other)
         
+    @classmethod
+    def from_tree_file(cls, path, pattern):
+        """
+        Same as Dictable(tree, pattern) where tree is the JSON (or YAML) document in path. 
+        JSON is streamed, so only the columns named in the pattern are decoded and subtrees not matching its fixed keys are skipped unbuilt.
+        
+        >>> Dictable.from_tree_file('school.json', 'students/%id/classes/%subject/%grade')
+        """
+        return cls(tree_file_to_columns(path, pattern))
+
     def to_tree(self, pattern, tree = dict):
         """
         self = Dictable(name = ['alan', 'beth', 'charles'], surname = ['smith', 'jones', 'patel'], gender = ['m','f','m'])
@@ -690,7 +1204,5 @@ class Dictable(Dict):
         assert t1 == {'students': {'alan': 'smith', 'beth': 'jones', 'charles': 'patel'}}
         assert t1 == t2
         """
-        pattern = _as_pattern(pattern)
-        items = [_pattern_to_item(pattern, row) for row in self]
-        return items_to_tree(items = items, tree = tree)
+        return as_tree_pattern(pattern).build(self, tree = tree)
 
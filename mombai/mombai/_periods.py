@@ -1,17 +1,31 @@
-from mombai._dictable import Dictable
 import datetime
+import numpy as np
 from dateutil import relativedelta
 from dateutil.relativedelta import *
-from dateutil.rrule import rrule, WEEKLY, SA, SU, MO, TU, WE,TH, FR
 
 T0 = datetime.datetime(1970,1,1)
 T1 = datetime.datetime(2300,1,1)
 
 
-_history = Dictable(date = list(rrule(WEEKLY, wkst=SU, byweekday=(MO,TU,WE,TH, FR), dtstart = T0, until = T1)))
+_history = None
+
+def _weekdays():
+    """
+    The weekdays from T0 to T1 as a datetime64[D] array. It is built on first use rather than at import.
+    """
+    global _history
+    if _history is None:
+        days = np.arange(np.datetime64(T0, 'D'), np.datetime64(T1, 'D') + 1)
+        _history = days[(days.astype(np.int64) + 3) % 7 < 5] ## 1970-01-01 was a Thursday
+    return _history
+
 def as_holiday(dates):
-    hols = _history.xor(dict(date = dates))    
-    return hols
+    """
+    Given the business dates (e.g. the dates on which a market traded), returns the holidays: the weekdays not in dates, as a datetime64[D] array
+    >>> hols = as_holiday([datetime.datetime(2001,4,2), datetime.datetime(2001,4,4)])
+    >>> assert np.datetime64('2001-04-03') in hols and np.datetime64('2001-04-02') not in hols
+    """
+    return np.setdiff1d(_weekdays(), np.asarray(dates, dtype = 'datetime64[D]'))
       
 day = datetime.timedelta(1)
 week = 7 * day
@@ -46,17 +60,38 @@ def _ymd2dt(y,m,d):
     y,m = _as_ym(y,m)
     return datetime.datetime(y,m,1) + (d-1)*day
 
+def _ymd2dt_array(y,m,d):
+    """
+    vectorised _ymd2dt: y,m,d are integer arrays and the same out-of-range month/day rules apply.
+    returns a datetime64[D] array
+    >>> import numpy as np
+    >>> assert list(_ymd2dt_array(np.array([2001,2001]), np.array([0,13]), np.array([0,1]))) == [np.datetime64('2000-11-30'), np.datetime64('2002-01-01')]
+    """
+    months = (np.asarray(y) - 1970) * 12 + (np.asarray(m) - 1)
+    return months.astype('datetime64[M]').astype('datetime64[D]') + (np.asarray(d) - 1)
+
 def is_eom(date):
     return (date+day).month != date.month
 
-def is_weekend(date, locale=None):
+def _weekend(locale=None):
     if locale is None: 
-        return date.weekday()>=5
+        return (5,6)
     elif locale.lower() == 'israel':
-        return date.weekday() in [4,5]
+        return (4,5)
     else:
         raise ValueError('This locale not implemented')
 
+def is_weekend(date, locale=None):
+    return date.weekday() in _weekend(locale)
+
+def _is_date_array(dates):
+    """
+    True for datetime64 arrays and object arrays of dates (with None for missing ones), the arrays that Month and schedule accept
+    """
+    if dates.dtype.kind == 'M':
+        return True
+    return dates.dtype.kind == 'O' and all(d is None or isinstance(d, (datetime.date, np.datetime64)) for d in dates.flat)
+
 class Month(object):
     """
     Month is a class allowing us to add months to dates. Month arithmetic is a tricky question:
@@ -68,14 +103,43 @@ class Month(object):
     
     >>> assert datetime.datetime(2001,1,30) + Month(1) == datetime.datetime(2001,2,28)
     >>> assert datetime.datetime(2001,1,31) + Month(1, eom = True) == datetime.datetime(2001,2,28)
+    
+    Arrays of dates (datetime64 arrays or Dictable columns of datetimes) are shifted in a single vectorised step:
+    
+    >>> dates = np.array(['2001-01-30', '2001-02-28'], 'datetime64[D]')
+    >>> assert list(dates + Month(1)) == [np.datetime64('2001-02-28'), np.datetime64('2001-03-28')]
+    >>> assert list(dates + Month(1, eom = True)) == [np.datetime64('2001-02-28'), np.datetime64('2001-03-31')]
+    >>> assert np.datetime64('2001-01-31') + Month(1) == np.datetime64('2001-02-28')
     """
+    __array_ufunc__ = None ## so that numpy arrays defer to __radd__ rather than adding element by element
+
     def __init__(self, m=1, eom = False):
         self.m = m
         self.eom = eom
     def copy(self):
         return Month(m = self.m, eom = self.eom)
     
+    def _add_days(self, days, m):
+        """
+        vectorised addition of m months to a datetime64[D] array, with the same month-end clipping and eom rule as __add__
+        """
+        months = days.astype('datetime64[M]')
+        target = months + m
+        eom = (target + 1).astype('datetime64[D]') - 1
+        res = np.minimum(target.astype('datetime64[D]') + (days - months.astype('datetime64[D]')), eom)
+        if self.eom:
+            res = np.where((days + 1).astype('datetime64[M]') != months, eom, res)
+        return res
+
     def __add__(self, date):
+        if not isinstance(date, datetime.date):
+            dates = np.asarray(date)
+            if not _is_date_array(dates):
+                return NotImplemented
+            if dates.dtype.kind == 'M':
+                res = self._add_days(dates.astype('datetime64[D]'), self.m).astype(dates.dtype)
+                return res[()] if isinstance(date, np.datetime64) else res
+            return self._add_days(dates.astype('datetime64[D]'), self.m).astype('datetime64[us]').astype(object)
         eom = _ymd2dt(date.year, date.month+1+self.m, 0)
         if self.eom and is_eom(date):
             return eom
@@ -110,6 +174,187 @@ class Month(object):
 
 
 
+_EPOCH = datetime.date(1970,1,1).toordinal()
+
+def _day_numbers(dates):
+    """
+    converts datetime64 or datetime arrays into days since 1970-01-01, returning the days and the mask of missing dates
+    """
+    days = np.asarray(dates)
+    if days.dtype.kind != 'M':
+        days = days.astype('datetime64[us]')
+    days = days.astype('datetime64[D]')
+    nat = np.isnat(days)
+    return np.where(nat, 0, days.astype(np.int64)), nat
+
+
+def _as_convention(convention):
+    """
+    normalises a business day convention to 'f' (following), 'p' (previous) or 'm' (modified following), the default
+    >>> assert _as_convention('Following') == 'f' and _as_convention(None) == 'm'
+    """
+    if convention is None:
+        convention = 'm'
+    convention = str(convention)[:1].lower()
+    if convention not in ('p', 'f', 'm'):
+        raise ValueError('only prev/following/modified following are allowed')
+    return convention
+
+
+class Calendar(object):
+    """
+    A business-day calendar: holds the sorted array of business days (as days since 1970-01-01), i.e. all days but weekends and holidays.
+    Business day arithmetic is an index lookup into this array, so shifting by b business days costs O(log n) however large b is,
+    and whole datetime64 arrays (or Dictable date columns) are shifted or adjusted in a single call.
+    
+    The array covers T0 to T1 and is extended on demand for dates outside that range.
+    
+    >>> cal = Calendar(hols = [datetime.datetime(2001,4,2)])
+    >>> assert cal.is_holiday(datetime.datetime(2001,4,2)) and cal.is_holiday(datetime.datetime(2001,3,31))
+    >>> assert cal.add(datetime.datetime(2001,3,30), 1) == datetime.datetime(2001,4,3)
+    >>> dates = np.array(['2001-03-30', '2001-03-31'], 'datetime64[D]')
+    >>> assert list(cal.add(dates, 1, 'f')) == [np.datetime64('2001-04-03'), np.datetime64('2001-04-04')]
+    >>> assert list(cal.adjust(dates, 'p')) == [np.datetime64('2001-03-30'), np.datetime64('2001-03-30')]
+    """
+    def __init__(self, hols = None, locale = None, start = T0, end = T1):
+        self.weekend = _weekend(locale)
+        self.hols = np.unique(_day_numbers([] if hols is None else hols)[0])
+        self.start = self.end = _day_numbers([start])[0][0]
+        self.days = np.zeros(0, dtype = np.int64)
+        self._cover(self.start, _day_numbers([end])[0][0])
+    
+    def _cover(self, start, end):
+        """
+        makes sure that self.days covers all business days in [start, end)
+        """
+        if start < self.start or end > self.end:
+            self.start = min(start, self.start)
+            self.end = max(end, self.end)
+            days = np.arange(self.start, self.end, dtype = np.int64)
+            days = days[~np.isin((days + 3) % 7, self.weekend)] ## 1970-01-01 was a Thursday
+            self.days = np.setdiff1d(days, self.hols, assume_unique = True)
+    
+    def _adjust(self, days, convention):
+        following = self.days[np.searchsorted(self.days, days, 'left')]
+        if convention == 'f':
+            return following
+        previous = self.days[np.searchsorted(self.days, days, 'right') - 1]
+        if convention == 'p':
+            return previous
+        month_of = lambda d: d.astype('datetime64[D]').astype('datetime64[M]')
+        return np.where(month_of(following) != month_of(days), previous, following)
+    
+    def _shift(self, days, b, convention):
+        """
+        returns the business days, b business days after the days adjusted per convention
+        """
+        convention = _as_convention(convention)
+        pad = 2 * abs(b) + 14
+        while True:
+            self._cover(days.min() - pad, days.max() + pad + 1)
+            i = np.searchsorted(self.days, self._adjust(days, convention)) + b
+            if i.min() >= 0 and i.max() < len(self.days):
+                return self.days[i]
+            pad *= 2
+
+    def add(self, date, b = 0, convention = 'm'):
+        """
+        adds b business days to the date after adjusting it for convention (following, previous, modified following). 
+        date can be a datetime, a date, a datetime64 or an array (datetime64 or datetime objects); any time of day is kept.
+        """
+        if isinstance(date, datetime.date):
+            days = np.array([date.toordinal() - _EPOCH])
+            return date + int(self._shift(days, b, convention)[0] - days[0]) * day
+        dates = np.asarray(date)
+        if not _is_date_array(dates):
+            raise TypeError('cannot add business days to %s of dtype %s'%(type(date).__name__, dates.dtype))
+        res = self._add_array(np.atleast_1d(dates), b, convention).reshape(dates.shape)
+        return res[()] if isinstance(date, np.datetime64) else res
+
+    def _add_array(self, dates, b, convention):
+        days, nat = _day_numbers(dates)
+        if len(days) == 0 or nat.all():
+            return dates.copy()
+        shift = np.zeros(days.shape, dtype = np.int64)
+        shift[~nat] = self._shift(days[~nat], b, convention) - days[~nat]
+        if dates.dtype.kind == 'M':
+            return dates + shift.astype('timedelta64[D]')
+        res = dates.copy()
+        res[~nat] = dates[~nat] + shift[~nat] * day
+        return res
+
+    def adjust(self, date, convention = 'm'):
+        return self.add(date, 0, convention)
+
+    def is_holiday(self, date):
+        if isinstance(date, datetime.date):
+            return bool(self.is_holiday(np.array([date.toordinal() - _EPOCH], dtype = 'datetime64[D]'))[0])
+        days, nat = _day_numbers(date)
+        self._cover(days.min(initial = self.start), days.max(initial = self.start) + 1)
+        i = np.searchsorted(self.days, days)
+        return nat | (self.days[np.minimum(i, len(self.days) - 1)] != days)
+
+    def __repr__(self):
+        return 'Calendar(%i holidays)'%len(self.hols)
+
+_calendar = None
+
+def as_calendar(hols = None):
+    """
+    as_calendar(None) is the (lazily built) weekends-only Calendar, a Calendar is returned as is, a list of holidays becomes a Calendar
+    """
+    global _calendar
+    if isinstance(hols, Calendar):
+        return hols
+    elif hols is None:
+        if _calendar is None:
+            _calendar = Calendar()
+        return _calendar
+    else:
+        return Calendar(hols)
+
+
+def schedule(start, end, step):
+    """
+    Roll schedules: the dates start, start + step, start + 2 * step... for as long as they do not go past end.
+    Each date is computed from start (not from the previous date), with the month-end clipping and eom rule of step.
+    A negative step rolls backwards, e.g. from maturity to the effective date of a swap.
+    
+    start and end are dates or arrays of dates (e.g. Dictable columns). schedule is a generator yielding one schedule (an array of dates) per start/end pair,
+    all the schedules being computed in one vectorised step over the candidate dates of each pair, so a single long schedule does not pad the others.
+    
+    >>> D = datetime.datetime
+    >>> assert [list(s) for s in schedule(D(2001,1,31), D(2001,7,31), Month(2))] == [[D(2001,1,31), D(2001,3,31), D(2001,5,31), D(2001,7,31)]]
+    >>> starts = np.array(['2001-01-15', '2001-02-28'], 'datetime64[D]')
+    >>> ends = np.array(['2001-04-15', '2001-06-30'], 'datetime64[D]')
+    >>> first, second = schedule(starts, ends, Month(2, eom = True))
+    >>> assert list(first) == list(np.array(['2001-01-15', '2001-03-15'], 'datetime64[D]'))
+    >>> assert list(second) == list(np.array(['2001-02-28', '2001-04-30', '2001-06-30'], 'datetime64[D]'))
+    """
+    if not isinstance(step, Month):
+        step = Month(step)
+    if step.m == 0:
+        raise ValueError('schedule step must be a non-zero number of months')
+    starts, ends = np.broadcast_arrays(np.asarray(start), np.asarray(end))
+    dtype = starts.dtype if starts.dtype.kind == 'M' else None
+    starts = starts.ravel().astype('datetime64[D]')
+    ends = ends.ravel().astype('datetime64[D]')
+    if len(starts) == 0:
+        return
+    months = (ends.astype('datetime64[M]') - starts.astype('datetime64[M]')).astype(np.int64) // step.m
+    months[np.isnat(starts) | np.isnat(ends)] = 0
+    n = np.maximum(months, 0) + 2 ## candidate dates per row, at most one past end
+    rows = np.repeat(np.arange(len(n)), n)
+    k = np.arange(len(rows)) - np.repeat(np.cumsum(n) - n, n) ## 0, 1, ..., n-1 within each row
+    dates = step._add_days(starts[rows], step.m * k)
+    ok = (dates <= ends[rows]) if step.m > 0 else (dates >= ends[rows])
+    dates = dates[ok]
+    dates = dates.astype(dtype) if dtype is not None else dates.astype('datetime64[us]').astype(object)
+    counts = np.bincount(rows[ok], minlength = len(n))
+    for row in np.split(dates, np.cumsum(counts)[:-1]):
+        yield row
+
+
 class BusinessDay(object):
     """
     In determining schedule of e.g. a swap, we first start at the maturity and work backwards at 3M or 6M intervals.    
@@ -126,26 +371,32 @@ class BusinessDay(object):
     >>> assert BusinessDay(convention = 'm').adjust(date) == datetime.datetime(2001,3,30) # Friday previous as Monday following is April
     >>> assert BusinessDay(convention = 'm').adjust(date-week) == datetime.datetime(2001,3,26) # Monday following
     
-    Implementing a full Holiday Calendar is possible but we would then think about optimization
+    Holidays are supported via hols, a list of holidays or a Calendar. The arithmetic is done by the Calendar so arrays of dates are supported too:
+    
+    >>> assert BusinessDay(1, hols = [datetime.datetime(2001,4,2)]) + date == datetime.datetime(2001,4,3)
+    >>> assert list(np.array(['2001-03-30', '2001-03-31'], 'datetime64[D]') + BusinessDay(2, 'f')) == [np.datetime64('2001-04-03'), np.datetime64('2001-04-04')]
     """
+    __array_ufunc__ = None ## so that numpy arrays defer to __radd__ rather than adding element by element
+    
     def __init__(self, b=0, convention = 'm', hols = None):
         self.b = b
-        self.convention = self._as_convention(convention)
+        self.convention = _as_convention(convention)
         self.hols = hols
+        self._calendar = None
 
-    def _as_convention(self, convention):
-        if convention is None:
-            convention = 'm'
-        convention = convention[0].lower()
-        if convention not in ('p', 'f', 'm'):
-            raise ValueError('only prev/following/modified following are allowed')
-        return convention
+    @property
+    def calendar(self):
+        if self._calendar is None:
+            self._calendar = as_calendar(self.hols)
+        return self._calendar
 
     def is_holiday(self, date):
-        return is_weekend(date)
+        return self.calendar.is_holiday(date)
             
     def copy(self):
-        return BusinessDay(b = self.b,  convention = self.convention)
+        res = BusinessDay(b = self.b,  convention = self.convention, hols = self.hols)
+        res._calendar = self._calendar
+        return res
 
     def __mul__(self, days):
         res = self.copy()
@@ -155,24 +406,7 @@ class BusinessDay(object):
     __rmul__ = __mul__
     
     def __add__(self, date):
-        """
-        for the time being, we ignore the holidays calenday
-        """
-        date = self.adjust(date)
-        weeks = self.b // 5
-        remainder = self.b % 5
-        res = date + weeks * week
-        while remainder>0:
-            res += day
-            remainder -=1
-            while self.is_holiday(res):
-                res += day
-        while remainder<0:
-            res -= day
-            remainder +=1
-            while self.is_holiday(res):
-                res -= day
-        return res
+        return self.calendar.add(date, self.b, self.convention)
             
     __radd__ = __add__ 
 
@@ -182,29 +416,9 @@ class BusinessDay(object):
     def __rsub__(self, other):
         return other + (-self)
     
-    def _following(self, date):
-        return date + (7-date.weekday()) * day
-    
-    def _previous(self, date):
-        return date - (date.weekday()-4) * day
-
-    
     def adjust(self, date):
-        if self.is_holiday(date):
-            if self.convention.startswith('p') :
-                return self._previous(date)
-            elif self.convention.startswith('f'):
-                return self._following(date)
-            elif self.convention.startswith('m'):
-                following = self._following(date)
-                if following.month!= date.month:
-                    return self._previous(date)
-                else:
-                    return following
-            else:
-                raise ValueError('adjust convention %s not implemented'%self.convention)
-        else:
-            return date
+        return self.calendar.adjust(date, self.convention)
+
     def __repr__(self):
         return "BusinessDays(%i) %s"%(self.b, self.convention)
 
@@ -1,4 +1,5 @@
-from mombai._compare import eq, Cmp, cmp, Sort
+from mombai._compare import eq, Cmp, cmp, Sort, sort_key, as_cmp
+import pytest
 from numpy import nan, array, int64
 import numpy as np
 import pandas as pd
@@ -26,6 +27,29 @@ def test_eq():
     assert not eq(pd.DataFrame([1,np.nan], columns = ['a']), pd.DataFrame([1,np.nan], columns = ['b']))
     assert not eq(pd.DataFrame([1,np.nan], columns = ['a'], index=['a','b']), pd.DataFrame([1,np.nan], columns = ['a'], index=[0,1]))
 
+def test_eq_typed_arrays():
+    assert eq(np.array([1., nan, 3.]), np.array([1., nan, 3.]))
+    assert not eq(np.array([1., nan, 3.]), np.array([1., 2., 3.]))
+    assert eq(np.array([1, 2]), np.array([1., 2.]))
+    assert eq(np.array(['a', 'b']), np.array(['a', 'b']))
+    assert not eq(np.array(['a', 'b']), np.array(['a', 'c']))
+    assert not eq(np.array(['1']), np.array([1])) ## string vs number
+    assert eq(np.array(['2001-01-01', 'NaT'], dtype = 'datetime64[D]'), np.array(['2001-01-01', 'NaT'], dtype = 'datetime64[D]'))
+    assert not eq(np.zeros((2,2)), np.zeros(4)) ## shape mismatch
+    assert eq(np.array([]), np.array([], dtype = 'object'))
+    assert eq(np.array([1, 'a', nan], dtype = 'object'), np.array([1., 'a', nan], dtype = 'object'))
+
+
+def test_eq_large_dicts_of_arrays():
+    n = 10**6
+    x = dict(a = np.arange(n) * 1., b = np.array(['x', 'y'] * (n//2)))
+    x['a'][::3] = nan
+    y = {key : value.copy() for key, value in x.items()}
+    assert eq(x, y)
+    y['a'][-1] = 0
+    assert not eq(x, y)
+
+
 def test_Cmp():
     assert Cmp(None)<Cmp(1)
     assert Cmp(1.0) == Cmp(1)
@@ -68,3 +92,43 @@ def test_Sort_single_mixed_values_with_strings():
     assert eq(i.argsort, array([7, 3, 2, 0, 5, 6, 1, 8, 9, 4], dtype=int64))
     assert eq(i.unique, [array([None, 1.0, 2, 3, 4, 6, nan, 'a', 'b'])])
     assert i.group(values) ==  [[None], [1.0], [2], [3, 3.0], [4], [6], [nan], ['a'], ['b']]
+
+
+def test_sort_key_matches_cmp():
+    values = [3, 'b', None, nan, 0.5, [1,2], [0,1,2], [], (1,), (0, nan), {'a': 1}, {'a': 0, 'b': 1}, np.array([2,1]), 1.0, True]
+    assert [sort_key(v) for v in sorted(values, key = sort_key)] == [sort_key(v) for v in sorted(values, key = Cmp)]
+    assert sort_key(1) == sort_key(1.0)
+    assert sort_key(nan) > sort_key(1e300)
+    assert sort_key([1,2]) < sort_key([0,1,2])
+    assert cmp([1,2], [0,1,2]) == -1
+
+
+def test_Sort_uses_sort_key_ranks():
+    values = [3, 'b', None, nan, 0.5, [1,2], (0, nan), {'a': 1}, 1.0, 'a', 3.0]
+    keyed = Sort([values])
+    legacy = Sort([values], key = lambda vals: as_cmp([np.asarray(vals[0])]))
+    assert eq(keyed.argsort, legacy.argsort)
+    assert keyed.keys[0].dtype != np.dtype('O')
+
+
+def test_Sort_descending_keeps_typed_keys():
+    values = [3, 1, nan, 2, 1, 5.]
+    s = Sort([values], ascending = False)
+    assert list(s.argsort) == [2, 5, 0, 3, 1, 4]
+    assert all(key.dtype != np.dtype('O') for key in s.keys)
+    dates = np.array(['2020-01-02', 'NaT', '2020-01-01', '2020-01-03'], dtype = 'datetime64[D]')
+    assert list(Sort([dates], ascending = False).argsort) == [1, 3, 0, 2]
+    words = np.array(['b', 'a', 'c', 'a'])
+    assert list(Sort([words], ascending = False).argsort) == [2, 0, 1, 3]
+    assert list(Sort([np.array([2, 1, 3], dtype = 'uint8')], ascending = False).argsort) == [2, 0, 1]
+    mixed = [1, None, 'a', nan, 0.5]
+    assert list(Sort([mixed], ascending = False).argsort) == list(Sort([mixed]).argsort[::-1])
+
+
+def test_Sort_mixed_directions():
+    a = ['x', 'y', 'x', 'y', 'x']
+    b = [1, 2, 3, 4, 5]
+    s = Sort([a, b], ascending = [True, False])
+    assert list(s.argsort) == [4, 2, 0, 3, 1]
+    with pytest.raises(ValueError):
+        Sort([a, b], ascending = [True])
@@ -1,4 +1,4 @@
-from mombai._containers import ordered_set, slist, args_to_list, args_to_dict, args_zip, is_array, as_list, as_ndarray, as_array
+from mombai._containers import ordered_set, slist, args_to_list, args_to_dict, args_zip, args_len, is_array, as_list, as_ndarray, as_array, _is_bool_mask
 from mombai._compare import eq, Cmp, cmp
 import numpy as np
 from numpy import nan
@@ -54,6 +54,45 @@ def test_as_ndarray():
     assert eq(x = as_ndarray(['a',[1,2]]), y = np.array(['a',[1,2]], dtype='object'))
 
 
+def test_as_ndarray_fast_paths():
+    import array
+    assert eq(as_ndarray(range(1,7,2)), np.array([1,3,5]))
+    assert eq(as_ndarray(pd.Series([1.,2.])), np.array([1.,2.]))
+    assert eq(as_ndarray(pd.Index(['a','b'])), np.array(['a','b']))
+    for values in [['a','b'], ['a', None], [1, 'a'], [1.5, 2.5]]:
+        assert as_ndarray(pd.Series(values, dtype = object)).dtype == as_ndarray(values).dtype
+    assert as_ndarray(pd.Series(['x', 'y'])).dtype == np.dtype('<U1')
+    assert as_ndarray(pd.Series(['x', 'y'], dtype = 'string')).dtype == np.dtype('<U1')
+    assert as_ndarray(pd.Series(['x', 'y']), dtype = object).dtype == np.dtype('O')
+    assert eq(as_ndarray(array.array('d', [1.,2.])), np.array([1.,2.]))
+    assert eq(as_ndarray(memoryview(array.array('l', [1,2]))), np.array([1,2]))
+    x = np.array([1,2])
+    assert as_ndarray(x) is x
+
+
+def test_as_ndarray_dtype():
+    assert as_ndarray([1,2.]).dtype == object ## mixed types
+    assert as_ndarray([1,2.], dtype = float).dtype == float
+    assert as_ndarray(np.array([1,2]), dtype = float).dtype == float
+    assert as_ndarray([1,2]).dtype == np.array([1]).dtype
+
+
+def test_args_zip():
+    assert list(args_zip(np.array([1,2]), 'a', [3,4])) == [(1, 'a', 3), (2, 'a', 4)]
+    assert list(args_zip([1], dict(a=1).keys())) == [(1, 'a')]
+    assert list(args_zip(None, 1)) == []
+    with pytest.raises(ValueError):
+        args_zip([1,2], [1,2,3])
+
+
+def test_args_len():
+    assert args_len([1,2], 1, 'ab') == 2
+    assert args_len(np.array([1,2,3]), pd.Series([1,2,3])) == 3
+    assert args_len(1, dict(a=1)) == 1
+    with pytest.raises(ValueError):
+        args_len([1,2], [1,2,3])
+
+
 def test_args_to_dict():
     assert args_to_dict(('a','b',dict(c='d'))) == dict(a='a',b='b',c='d')
     assert args_to_dict([dict(c='d')]) == dict(c='d')
@@ -62,3 +101,12 @@ def test_args_to_dict():
     with pytest.raises(ValueError):
         args_to_dict(['a','b',lambda c: c]) == dict(a='a',b='b',c='d', e='f')
 
+
+def test__is_bool_mask():
+    assert _is_bool_mask(np.array([True, False]))
+    assert not _is_bool_mask(np.array([0, 1]))
+    assert _is_bool_mask([True, 0, 1])
+    assert _is_bool_mask(np.array([True, 1], dtype = 'object'))
+    assert not _is_bool_mask([True, False], n = 3)
+    assert not _is_bool_mask(range(2))
+    assert not _is_bool_mask([])
@@ -1,7 +1,9 @@
-from mombai._dates import today, dt
+from mombai._dates import today, dt, _str2dt, _str_parsers, _str_shape
 from mombai._periods import day, month, week, bday, BusinessDay, Month, is_eom, year, quarter
 
 import datetime
+import pytest
+import numpy as np
 from dateutil import parser
 D = datetime.datetime
 
@@ -42,3 +44,47 @@ def test_dt():
 def test_dt_today():
     assert dt.today() == today()
 
+
+def test_dt_array():
+    values = [20010901, 37135, 2001, '20010901', '2001-09-01', '2001/09/01', '2001 09 01', '01/09/2001', '01-09-2001', 
+              '2001 Sep 1st', '1st Sep 2001', '2001-09-01T06:00:00', '2001-09-01 06:00:00.5', D(2001,9,1), datetime.date(2001,9,1), np.datetime64('2001-09-01')]
+    res = dt.array(values)
+    assert res.dtype == np.dtype('datetime64[ns]')
+    assert [np.datetime64(dt(v), 'ns') for v in values] == list(res)
+    assert list(dt.array(np.array([20010901, 20011231, 20010100]))) == [np.datetime64(dt(v)) for v in [20010901, 20011231, 20010100]]
+    assert list(dt.array(np.array(['01/09/2001', '31/12/2001']))) == [np.datetime64(D(2001,9,1)), np.datetime64(D(2001,12,31))]
+    assert list(dt.array([-1, 0, 1000])) == [np.datetime64(dt(v)) for v in [-1, 0, 1000]]
+
+
+def test_dt_array_floats_and_missing():
+    res = dt.array([37135.25, np.nan])
+    assert res[0] == np.datetime64(dt(37135.25))
+    assert np.isnat(res[1])
+    assert np.isnat(dt.array(['2001-09-01', None])[1])
+    assert dt.array(np.zeros((2,2), int) + 20010901).shape == (2,2)
+    assert len(dt.array([])) == 0
+
+
+def test_dt_array_out_of_ns_range():
+    res = dt.array([500000, 20010901])
+    assert res.dtype == object
+    assert list(res) == [dt(500000), dt(20010901)]
+
+
+def test_str2dt_caches_parser_by_shape():
+    _str_parsers.clear()
+    assert _str2dt('01/09/2001') == D(2001,9,1)
+    assert _str2dt('31/12/1999') == D(1999,12,31)
+    assert _str2dt('2001/09/01') == D(2001,9,1)
+    assert _str2dt('1/9/2001') == D(2001,9,1)
+    assert _str2dt('01/09/01') == parser.parse('01/09/01') ## no UK preference possible, dateutil decides
+    assert _str2dt('2001-09-01T06:00:00') == D(2001,9,1,6)
+    assert _str2dt('2011-12-31T23:59:59') == D(2011,12,31,23,59,59)
+    assert _str_parsers[_str_shape('2001-09-01T06:00:00')].args == ('%Y-%m-%dT%H:%M:%S',)
+    assert _str2dt('1 Sep 2001') == D(2001,9,1)
+    assert _str2dt('2 Oct 2002') == D(2002,10,2)
+    assert _str2dt('1st Sep 2001') == D(2001,9,1)
+    assert _str2dt('2nd Oct 2002') == D(2002,10,2)
+    assert _str_parsers[_str_shape('2nd Oct 2002')] == parser.parse
+    with pytest.raises(ValueError): ## strptime fails so dateutil is still asked
+        _str2dt('2001-13-01T06:00:00')
@@ -1,8 +1,11 @@
 from mombai._decorators import getargspec, ARGSPEC, getargs, decorate, cache, try_value, try_back, try_none, try_list, try_str, try_dict, try_nan, try_zero, support_kwargs, relabel
-from mombai._decorators import list_loop, dict_loop, callattr, callitem, Hash
+from mombai._decorators import list_loop, dict_loop, callattr, callitem, Hash, Cache
 import numpy as np
 from functools import partial
 import datetime
+import pytest
+import time
+import os
 
 def test_getargspec_existing():
     func = lambda x: x
@@ -91,6 +94,176 @@ def test_cache_class_method():
     assert t(4) == 4
     assert t.cache == {('__call__', (4,), ()): 4}
 
+def test_cache_maxsize_lru():
+    f = cache(maxsize = 2)(lambda x: x * 2)
+    assert f(1) == 2 and f(2) == 4 and f(1) == 2
+    assert f(3) == 6 ## evicts 2, the least recently used
+    assert list(f.cache.keys()) == [((1,), ()), ((3,), ())]
+    assert f.cache.stats() == dict(hits = 1, misses = 3, evictions = 1, size = 2, maxsize = 2)
+
+
+def test_cache_maxsize_lfu():
+    f = cache(maxsize = 2, policy = 'lfu')(lambda x: x * 2)
+    f(1); f(1); f(2); f(3) ## 2 is used least
+    assert list(f.cache.keys()) == [((1,), ()), ((3,), ())]
+    with pytest.raises(ValueError):
+        cache(policy = 'fifo')(lambda x: x)
+
+
+def test_cache_lfu_evicts_least_used_oldest_first():
+    c = Cache(maxsize = 3, policy = 'lfu')
+    for key in 'abcbcb':
+        c.fetch(key, lambda: key)
+    c.fetch('d', lambda: 'd') ## a is used once
+    c.fetch('e', lambda: 'e') ## d is used once, c twice
+    assert list(c.keys()) == ['b', 'c', 'e'] and c.evictions == 2
+    c.maxsize = 2
+    c.fetch('f', lambda: 'f') ## evicts e then c, leaving b, the most used
+    assert list(c.keys()) == ['b', 'f'] and c.evictions == 4
+    c.clear()
+    assert c.fetch('g', lambda: 'g') == 'g' and list(c.keys()) == ['g']
+
+
+def test_cache_ttl():
+    f = cache(ttl = 0.05)(lambda x: datetime.datetime.now())
+    now = f(1)
+    assert f(1) == now
+    time.sleep(0.1)
+    assert f(1) > now
+
+
+def test_cache_hash_args():
+    calls = []
+    def f(x):
+        calls.append(x)
+        return len(x)
+    g = cache(f)
+    assert g([1,2]) == 2 and g([1,2]) == 2
+    assert len(calls) == 2 and g.cache == {} ## unhashable args are not cached
+    h = cache(hash_args = True)(f)
+    assert h([1,2]) == 2 and h([1,2]) == 2 and h(np.array([1,2,3])) == 3 and h(np.array([1,2,3])) == 3
+    assert len(calls) == 4 and h.cache.hits == 2
+
+
+def test_cache_class_method_with_property():
+    class test(object):
+        @property
+        @cache
+        def now(self):
+            return datetime.datetime.now()
+    t = test()
+    assert t.now == t.now
+    assert t.cache.hits == 1 and t.cache.misses == 1
+
+
+def test_cache_methods_reject_conflicting_settings():
+    class test(object):
+        @cache(maxsize = 2)
+        def f(self, x):
+            return x
+        @cache(maxsize = 2)
+        def g(self, x):
+            return -x
+        @cache(ttl = 10)
+        def h(self, x):
+            return x
+    t = test()
+    assert t.f(1) == 1 and t.g(1) == -1 and len(t.cache) == 2
+    with pytest.raises(ValueError):
+        t.h(1)
+
+
+@pytest.mark.parametrize('settings', [dict(policy = 'lfu', maxsize = 2), dict(ttl = 10), dict(maxsize = 1)])
+def test_cache_method_adopts_existing_dict(settings):
+    class test(object):
+        def __init__(self):
+            self.cache = {('f', (1,), ()): 'old', ('f', (2,), ()): 'older'}
+        @cache(**settings)
+        def f(self, x):
+            return 'new'
+    t = test()
+    assert t.f(1) == ('old' if settings.get('maxsize') != 1 else 'new')
+    assert t.f(1) == t.f(1) and t.f(3) == 'new'
+    assert isinstance(t.cache, Cache) and len(t.cache) <= (settings.get('maxsize') or 3)
+
+
+def test_cache_disk(tmp_path):
+    from mombai._dictable import Dictable
+    calls = []
+    def load(n, kind = 'array'):
+        calls.append(n)
+        if kind == 'array':
+            return np.arange(n)
+        elif kind == 'table':
+            return Dictable(a = range(n), b = 'x')
+        else:
+            return dict(n = n)
+    f = cache(store = 'disk', path = str(tmp_path))(load)
+    assert np.allclose(f(3), np.arange(3)) and np.allclose(f(3), np.arange(3))
+    assert f(2, kind = 'table') == Dictable(a = range(2), b = 'x')
+    assert f(kind = 'dict', n = 4) == dict(n = 4)
+    assert len(calls) == 3 and f.cache.hits == 1
+    g = cache(store = 'disk', path = str(tmp_path))(load) ## a new session
+    assert g(2, kind = 'table') == Dictable(a = range(2), b = 'x') and g(n = 4, kind = 'dict') == dict(n = 4)
+    assert len(calls) == 3 and len(g.cache) == 3
+    assert sorted(fn.split('.')[-1] for fn in os.listdir(g.cache.folder)) == ['npy', 'npz', 'pkl']
+
+
+def test_cache_disk_maxbytes(tmp_path):
+    f = cache(store = 'disk', path = str(tmp_path), maxbytes = 1000)(lambda n: np.zeros(n))
+    for n in range(10):
+        f(50)
+        f(n + 60)
+    assert f.cache.evictions > 0 and sum(os.path.getsize(os.path.join(f.cache.folder, fn)) for fn in os.listdir(f.cache.folder)) <= 1000
+
+
+def test_cache_disk_column_named_file(tmp_path):
+    from mombai._dictable import Dictable
+    f = cache(store = 'disk', path = str(tmp_path))(lambda n: Dictable(file = np.arange(n), x = 1))
+    assert f(3) == Dictable(file = np.arange(3), x = 1)
+    assert f(3) == Dictable(file = np.arange(3), x = 1) and f.cache.hits == 1
+    assert [fn.split('.')[-1] for fn in os.listdir(f.cache.folder)] == ['npz']
+
+
+def test_cache_disk_save_failure(tmp_path):
+    f = cache(store = 'disk', path = str(tmp_path))(lambda n: (lambda: n)) ## a lambda cannot be pickled
+    assert f(1)() == 1 ## the result is still returned
+    assert os.listdir(f.cache.folder) == [] ## and no tmp file is left behind
+
+
+def test_cache_disk_binds_arguments(tmp_path):
+    calls = []
+    def load(n, kind = 'array'):
+        calls.append(n)
+        return np.arange(n)
+    f = cache(store = 'disk', path = str(tmp_path))(load)
+    f(3); f(n = 3); f(3, 'array'); f(kind = 'array', n = 3)
+    assert len(calls) == 1 and len(f.cache) == 1
+
+
+def test_cache_hash_args_are_type_strict():
+    f = cache(hash_args = True)(lambda x: type(x[0]).__name__)
+    assert [f([1]), f([1.0]), f([True])] == ['int', 'float', 'bool']
+
+
+def test_cache_disk_keys_are_type_strict(tmp_path):
+    g = cache(store = 'disk', path = str(tmp_path))(lambda n: np.arange(n))
+    assert g(3).dtype == np.arange(3).dtype
+    assert g(3.0).dtype == np.float64
+    h = cache(store = 'disk', path = str(tmp_path))(lambda x: type(x).__name__)
+    assert [h(1), h(1.0), h(True), h([1]), h((1,))] == ['int', 'float', 'bool', 'list', 'tuple']
+    assert [h(1), h(1.0), h(True), h([1]), h((1,))] == ['int', 'float', 'bool', 'list', 'tuple']
+    assert h.cache.hits == 5 and h.cache.misses == 5
+
+
+def test_cache_disk_not_for_methods():
+    with pytest.raises(ValueError):
+        class test(object):
+            @cache(store = 'disk')
+            def f(self, x):
+                return x
+
+
 def test_relabel():
     relabels = dict(b='BB', c = lambda value: value.upper())
     assert relabel('a', relabels) == 'a'
@@ -124,6 +297,13 @@ def test_support_kwargs():
     assert relabeled_func(a=1,BB=2,C=3, some_other_stuff =3)==6
 
 
+def test_support_kwargs_positional():
+    relabeled_func = support_kwargs(dict(b='BB'))(lambda a, b, c=1: a+b+c)
+    assert relabeled_func.positional == ['a', 'BB', 'c']
+    assert support_kwargs()(lambda x, **kwargs: x).positional is None
+    assert support_kwargs()(lambda x, *, y: x).positional is None
+
+
 def test_support_kwargs_with_varkw():
     function = lambda x, **kwargs : ''.join(['x'*x] + [key*value for key, value in kwargs.items()]) 
     support_kwargs()(function)(x=1, b=2, c=3) == 'xbbccc'
@@ -132,11 +312,30 @@ def test_support_kwargs_with_varkw():
 
 def test_Hash():
     d = dict(a = 1, b=2)
-    assert Hash(d) == hash(tuple(sorted(d.items())))
+    assert Hash(d) == Hash(dict(b = 2, a = 1)) and isinstance(Hash(d), int)
     lst = [1,2,3]
-    assert Hash(lst) == hash(tuple(lst))
+    assert Hash(lst) == Hash(tuple(lst))
     i = 5
     assert Hash(i) == i
+    assert Hash('a') == 'a'
+
+def test_Hash_is_stable():
+    assert Hash(("a", 1)) == 3812988927338244401 ## does not depend on PYTHONHASHSEED
+    assert Hash(dict(a = [1, 'b'], c = datetime.datetime(2001,1,1))) == Hash(dict(c = datetime.datetime(2001,1,1), a = (1, 'b')))
+
+def test_Hash_of_arrays():
+    from mombai._dictable import Dictable
+    assert Hash(np.array([1., np.nan])) == Hash(np.array([1., np.nan]))
+    assert Hash(np.array([1., 2.])) != Hash(np.array([1., 3.]))
+    assert Hash(np.array([1, 2])) != Hash(np.array([1., 2.]))
+    assert Hash(dict(a = np.array([[1,2],[3,4]]))) != Hash(dict(a = np.array([1,2,3,4])))
+    assert Hash(Dictable(a = [1,2], b = 'x')) == Hash(Dictable(b = 'x', a = [1,2]))
+    x = np.arange(5)
+    x.flags.writeable = False
+    assert Hash(x) == Hash(x) == Hash(np.arange(5))
+    x.flags.writeable = True
+    x[0] = 10
+    assert Hash(x) != Hash(np.arange(5))
 
 def test_callitem():
     d = dict(a = lambda x,y,z=1: x+y+z, b = lambda x, y, z=2: x*y*z)
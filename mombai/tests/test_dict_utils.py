@@ -1,4 +1,5 @@
-from mombai._dict_utils import dict_zip, dict_concat, dict_merge, dict_append, dict_invert, dict_update_left, dict_update_right, dict_apply, data_and_columns_to_dict
+from mombai._dict_utils import dict_zip, dict_concat, dict_merge, dict_append, dict_invert, dict_update_left, dict_update_right, dict_apply, data_and_columns_to_dict, tree_to_dicts, tree_to_columns, tree_items, iter_tree_items, items_to_tree, _pattern_to_item, _is_pattern, as_tree_pattern, TreePattern
+import pytest
 from mombai._compare import eq
 import pandas as pd
 import numpy as np
@@ -69,3 +70,117 @@ def test_data_and_columns_to_dict():
     assert data_and_columns_to_dict(data) == dict(a=1,b=2)
     data = [['a','b'], [1,2],[3,4]]
     assert eq(data_and_columns_to_dict(data),  {'a': np.array([1, 3]), 'b': np.array([2, 4])})
+
+
+def _school():
+    return dict(teachers = dict(tid01 = dict(name = 'richard', surname = 'feynman', tutor = False),
+                                tid02 = dict(name = 'richard', surname = 'dawkins', tutor = True)),
+                students = dict(id01 = dict(name = 'james', surname = 'smith', classes = dict(english = 90, french = 80)),
+                                id02 = dict(name = 'steve', surname = 'jones', classes = dict(maths = 70))))
+
+def test_tree_to_dicts_order():
+    tree = _school()
+    assert tree_to_dicts(tree, 'students/%id/classes/%subject/%grade') == [dict(id = 'id01', subject = 'english', grade = 90), 
+                                                                          dict(id = 'id01', subject = 'french', grade = 80), 
+                                                                          dict(id = 'id02', subject = 'maths', grade = 70)]
+    assert tree_to_dicts(tree, '%who/%id/name/richard') == [dict(who = 'teachers', id = 'tid01'), dict(who = 'teachers', id = 'tid02')]
+    assert tree_to_dicts(tree, []) == [{}]
+    assert tree_to_dicts(tree, '%x/%x/name/%y')[0] == dict(x = 'teachers', y = 'richard')
+
+def test_tree_to_columns():
+    tree = _school()
+    pattern = 'students/%id/classes/%subject/%grade'
+    assert tree_to_columns(tree, pattern) == dict_concat(tree_to_dicts(tree, pattern))
+    assert tree_to_columns(tree, pattern) == dict(id = ['id01', 'id01', 'id02'], subject = ['english', 'french', 'maths'], grade = [90, 80, 70])
+    assert tree_to_columns(tree, 'parents/%id') == {}
+    assert tree_to_columns(tree, '%x/%x/name/%y') == dict(x = ['teachers', 'teachers', 'students', 'students'], y = ['richard', 'richard', 'james', 'steve'])
+
+def test_tree_items_deep_tree():
+    tree = leaf = {}
+    for i in range(5000):
+        leaf[i] = {}
+        leaf = leaf[i]
+    leaf['x'] = 1
+    items = tree_items(tree)
+    assert len(items) == 1 and items[0][-2:] == ('x', 1) and len(items[0]) == 5002
+    assert tree_items(_school())[:2] == [('teachers', 'tid01', 'name', 'richard'), ('teachers', 'tid01', 'surname', 'feynman')]
+    assert list(iter_tree_items(1)) == [(1,)]
+
+
+def test_TreePattern_build_matches_items_to_tree():
+    table = dict(name = ['adam', 'adam', 'beth'], subject = ['maths', 'physics', 'maths'], grade = [90, 80, 70])
+    pattern = 'students/%name/classes/%subject/%grade'
+    rows = [dict(zip(table, row)) for row in zip(*table.values())]
+    expected = items_to_tree([_pattern_to_item(pattern, row) for row in rows])
+    compiled = as_tree_pattern(pattern)
+    assert compiled.build(table) == expected
+    assert compiled.extract(expected) == table
+    with pytest.raises(ValueError):
+        as_tree_pattern('students/%subject').build(table)
+    assert as_tree_pattern('students/%subject').build(table, raise_if_duplicate = False) == dict(students = 'maths') ## last row wins
+    existing = dict(students = dict(adam = dict(classes = dict(maths = 0))))
+    assert compiled.build(table, existing)['students']['adam']['classes']['maths'] == 90
+
+
+def test_as_tree_pattern_is_cached():
+    assert as_tree_pattern('a/%b/%c') is as_tree_pattern('a/%b/%c')
+    assert as_tree_pattern(['a', '%b', '%c']) is as_tree_pattern('a/%b/%c')
+    assert isinstance(as_tree_pattern('a/%b'), TreePattern)
+    assert _is_pattern('a/%b') and not _is_pattern('a/b') and not _is_pattern('a/%b%c') and not _is_pattern(['a', '%b'])
+
+
+def test_tree_file_to_columns(tmp_path):
+    import json
+    tree = dict(meta = dict(note = 'braces } { and "quotes" \\ ]', values = [1, {'x': [2, 3]}, None]),
+                students = dict(id01 = dict(name = 'james', classes = dict(english = 90, french = 80.5), tags = ['a', 'b']),
+                                id02 = dict(name = 'zoë', classes = {}, tags = []),
+                                id03 = dict(name = 'steve', classes = dict(maths = None, art = True))),
+                teachers = [dict(name = 'richard')])
+    path = str(tmp_path / 'school.json')
+    with open(path, 'w') as f:
+        json.dump(tree, f, indent = 2)
+    from mombai._dict_utils import tree_file_to_columns
+    for pattern in ['students/%id/classes/%subject/%grade', 'students/%id/name/%name', '%section/%id/tags/%tags', 
+                    'students/%id/name/james', 'meta/%key', 'teachers/%x', 'nobody/%x', '%a/%b/%c/%d/%e']:
+        assert tree_file_to_columns(path, pattern) == tree_to_columns(tree, pattern)
+    compact = str(tmp_path / 'compact.json')
+    with open(compact, 'w') as f:
+        json.dump(tree, f, separators = (',', ':'))
+    assert tree_file_to_columns(compact, 'students/%id/classes/%subject/%grade') == tree_to_columns(tree, 'students/%id/classes/%subject/%grade')
+    repeated = str(tmp_path / 'repeated.json')
+    text = '{"a": {"x": 1, "y": 2, "x": {"z": 3}}, "b": {"x": 4}, "a": {"x": 5, "w": 6, "x": 7}}'
+    with open(repeated, 'w') as f:
+        f.write(text)
+    for pattern in ['%k/%key/%value', '%k/x/%value', 'a/%key/%value', '%k/%key/z/%value']:
+        assert tree_file_to_columns(repeated, pattern) == tree_to_columns(json.loads(text), pattern)
+    assert tree_file_to_columns(repeated, '%k/%key/%value') == dict(k = ['a', 'a', 'b'], key = ['x', 'w', 'x'], value = [7, 6, 4])
+
+
+@pytest.mark.parametrize('text', ['{"a": 1,}', '   ', '{1: 2}', '{"a": "x', '{"a" 1}', '{"a": 1', '[1', '{"a": }', '{"a": {"b": "x}}', '{"a": tru}'])
+def test_tree_file_to_columns_malformed(tmp_path, text):
+    from mombai._dict_utils import tree_file_to_columns
+    path = str(tmp_path / 'bad.json')
+    with open(path, 'w') as f:
+        f.write(text)
+    with pytest.raises(ValueError):
+        tree_file_to_columns(path, '%k/%v')
+
+
+def test_dict_merge_single_pass():
+    dicts = [{'a': 1, 'b': 4, 'x' : 1}, {'a': 2, 'b': 5, 'y' : 2}, {'a': 3, 'z' : 3}]
+    assert dict_merge(dicts, 'l', x = 'a', y = 'c') == {'a': 1, 'b': 4, 'z' : 3, 'y' : [None, 2, None],  'x' : [1]}
+    assert dict_merge(dicts, 'right', policies = dict(b = 'append')) == {'a': 3, 'b': [4, 5], 'x': 1, 'y': 2, 'z': 3}
+    assert dict_merge(dicts, 'c', keys = ['a', 'x']) == {'a': [1, 2, 3], 'x': [1, None, None]}
+    assert list(dict_merge(dicts, 'c').keys()) == ['a', 'b', 'x', 'y', 'z']
+    with pytest.raises(ValueError):
+        dict_merge(dicts, 'q')
+    many = [{i : i, i + 1 : i} for i in range(20000)]
+    assert dict_update_left(many)[1] == 0 and dict_update_right(many)[1] == 1 and len(dict_append(many)) == 20001
+
+
+def test_dict_merge_columnar():
+    tables = [dict(a = np.array([1,2]), b = np.array(['x', 'y'])), dict(a = np.array([5]), c = np.array([1.5]))]
+    merged = dict_merge(tables, 'c', columnar = True)
+    assert eq(merged['a'], np.array([1, 2, 5])) and list(merged['b']) == ['x', 'y', None] and list(merged['c']) == [None, None, 1.5]
+    merged = dict_merge([dict(a = np.array([1,2])), dict(a = np.array([3,4]), b = np.array([5,6]))], 'a', columnar = True)
+    assert eq(merged['a'], np.array([[1,3], [2,4]])) and eq(merged['b'], np.array([5,6]))
@@ -1,4 +1,4 @@
-from mombai._dictable import Dictable, Dict, as_ndarray, vstack, hstack, cartesian
+from mombai._dictable import Dictable, Dict, as_ndarray, vstack, hstack, cartesian, cartesian_pairs
 from mombai._compare import eq
 import pytest
 import numpy as np
@@ -46,6 +46,24 @@ def test_Dictable__mask():
     resampled = self._mask([2,1,0,0,2])
     assert len(resampled)==5 and np.allclose(resampled.a, [3,2,1,1,3]) 
 
+def test_Dictable_take():
+    d = Dictable(a = [1,2])
+    assert list(d.take([0,1]).a) == [1,2] ## never treated as a mask
+    assert list(d.take([1,1,0]).a) == [2,2,1]
+    assert len(d.take([])) == 0
+
+def test_Dictable_filter():
+    d = Dictable(a = [1,2,3])
+    assert list(d.filter([True, False, True]).a) == [1,3]
+    assert list(d.filter(np.array([1,0,1]), exc = True).a) == [2]
+    with pytest.raises(ValueError):
+        d.filter([True, False])
+
+def test_Dictable__mask_by_dtype():
+    d = Dictable(a = [1,2])
+    assert list(d._mask(np.array([0,1])).a) == [1,2] ## integer array is an index
+    assert list(d._mask(np.array([False,True])).a) == [2] ## bool array is a mask
+
 
 def test_Dictable__setitem__():
     d = Dictable(a = [1,2,3,4,5])
@@ -65,6 +83,15 @@ def test_Dictable_vectorize():
         sum(d.b)
     assert np.allclose(vsum(d.b), [0,1,3,6,10]) ## triangular functions        
 
+def test_Dictable_vectorize_positional():
+    d = Dictable(a = [1,2,3], b = 2, c = ['x','y','z'])
+    assert d[lambda a, b: a*b] == [2,4,6]
+    assert d[lambda a, b=10: a+b] == [3,4,5]
+    assert d[lambda a, d=10: a+d] == [11,12,13] ## default used as d is not a column
+    assert d[lambda: 1] == [1,1,1]
+    assert d.apply(lambda x, c: c + str(x), dict(x = 'a')) == ['x1','y2','z3']
+    assert d.do(lambda value, b: value*b, 'a').a.tolist() == [2,4,6]
+
 def test_Dictable_apply():
     d = Dictable(a=1)
     function = lambda x: x+2
@@ -162,6 +189,35 @@ def test_Dictable_sort_multitype():
     d = Dictable(a = [None, np.nan, np.array([2,3]), np.array([1,2]), 0.4])
     assert d.sort('a') == Dictable(a = [None, 0.4, np.nan, np.array([1,2]), np.array([2,3])])
 
+def test_Dictable_sort_descending():
+    d = Dictable(a = list('abracadabra'), b=range(11), c = np.arange(0,33,3) % 11)
+    assert list(d.sort('c', ascending = False).c) == list(range(10, -1, -1))
+    res = d.sort('a', 'c', ascending = [False, True])
+    assert ''.join(res.a) == 'rrdcbbaaaaa' and list(res.c) == [5,6,7,1,2,3,0,4,8,9,10]
+    assert list(d.sort('a', 'c', ascending = [False, True], limit = 3).c) == [5,6,7]
+
+def test_Dictable_sort_limit_and_nlargest():
+    d = Dictable(a = list('abracadabra'), b=range(11), c = np.arange(0,33,3) % 11)
+    for by in [('c',), ('a',), ('a','c'), (lambda b: -b,)]:
+        full = d.sort(*by)
+        for n in [0, 1, 4, 11, 20]:
+            assert d.sort(*by, limit = n) == full[:n]
+            assert d.nsmallest(n, *by) == full[:n]
+    assert list(d.nlargest(3, 'c').c) == [10, 9, 8]
+    assert list(d.nlargest(4, 'a').b) == [2, 9, 6, 4] ## r,r,d,c with ties kept in original order
+    m = Dictable(a = [None, np.nan, np.array([2,3]), 'x', 0.4], b = range(5))
+    assert list(m.nsmallest(2, 'a').b) == [0, 4]
+    assert list(m.nlargest(2, 'a').b) == [3, 2]
+    f = Dictable(a = [1., np.nan, 3., np.nan, 2.], b = range(5))
+    assert list(f.nlargest(3, 'a').b) == [1, 3, 2]
+    assert list(f.nsmallest(3, 'a').b) == [0, 4, 2]
+    assert len(d.nlargest(0, 'a')) == 0 and len(f.nlargest(0, 'a')) == 0 and len(m.nlargest(0, 'a')) == 0
+    assert list(d.nlargest(20, 'a').b) == [2, 9, 6, 4, 1, 8, 0, 3, 5, 7, 10]
+    assert list(f.nlargest(5, 'a').b) == [1, 3, 2, 4, 0]
+    assert list(m.nlargest(5, 'a').b) == list(m.nlargest(4, 'a').b) + [0]
+    one = Dictable(a = [1.0])
+    assert one.nlargest(1, 'a') == one and one.nlargest(5, 'a') == one and one.nsmallest(1, 'a') == one
+
 def test_Dictable_listby():
     d = Dictable(a = list('abracadabra'), b=range(11), c = list('harrypotter'))
     per_a = d.listby('a')
@@ -315,9 +371,179 @@ def test_Dictable_merge_few_elements():
     d = Dictable(a=1) * Dictable(b=1)
     assert d == Dictable(a=1, b=1)
 
+def test_Dictable_merge_concat_policy():
+    lhs = Dictable(a = [1,2], b = [3,4], c = ['x', 'y'])
+    rhs = Dictable(a = [2,1], b = [6,5])
+    res = lhs.merge(rhs, 'a', merge = 'c')
+    assert list(res.a) == [1, 2] and res.b.tolist() == [[3, 5], [4, 6]] and res.c.tolist() == [['x', None], ['y', None]]
+    assert lhs.merge(rhs, 'a', merge = 'c', presorted = True).b.tolist() == [[3, 5], [4, 6]]
+    assert lhs.merge(rhs, 'a').b.tolist() == [[3, 5], [4, 6]]
+
 def test_Dictable_xor_few_elements():
     d = Dictable(a=[1,2]) / Dictable(b=1)
     assert d == Dictable(a=[1,2])
     d = Dictable(a=[1,2]) / Dictable(a=1)
     assert d == Dictable(a=2)
 
+
+
+def test_Dictable_merge_presorted():
+    lhs = Dictable(a = [1,1,2,4,6], b = [0,1,0,0,1], x = range(5))
+    rhs = Dictable(a = [0,1,1,4,4,6], b = [0,1,1,0,1,0], y = range(6))
+    for on in ['a', ['a','b']]:
+        assert lhs.merge(rhs, on, presorted = True) == lhs.merge(rhs, on)
+    unsorted = Dictable(a = [2,1], y = [0,1])
+    assert lhs.merge(unsorted, 'a', presorted = True) == lhs.merge(unsorted, 'a')
+    pair = lhs._presorted_pair(rhs, ['a'], ['a'])
+    assert list(pair.lhs_len) == [0, 2, 1, 1, 1] and list(pair.rhs_len) == [1, 2, 0, 2, 1]
+    assert [list(idx) for idx in pair.idx] == [[5], [0, 1, 6, 7], [2], [3, 8, 9], [4, 10]]
+    assert lhs.merge(rhs, 'a', presorted = True, max_rows = 7) == lhs.merge(rhs, 'a')
+    with pytest.raises(ValueError):
+        lhs.merge(rhs, 'a', presorted = True, max_rows = 6)
+    assert lhs._presorted_pair(unsorted, ['a'], ['a']) is None
+    assert eq(lhs.xor(rhs, 'a'), Dictable(a = 2, b = 0, x = 2))
+
+
+def test_Dictable_asof_merge():
+    trades = Dictable(date = [2, 5, 7, 0], qty = [10, 20, 30, 40])
+    quotes = Dictable(date = [8, 1, 5, 3], px = [103, 100, 102, 101])
+    res = trades.asof_merge(quotes, 'date')
+    assert list(res.qty) == [10, 20, 30] and list(res.px) == [100, 102, 102] and list(res.date) == [2, 5, 7]
+    res = trades.sort('date').asof_merge(quotes.sort('date'), 'date')
+    assert list(res.qty) == [10, 20, 30] and list(res.px) == [100, 102, 102]
+    with pytest.raises(ValueError):
+        trades.asof_merge(quotes, ['date', 'qty'], ['date', 'px'])
+    with pytest.raises(ValueError):
+        Dictable(date = [np.nan]).asof_merge(quotes, 'date')
+    res = trades.asof_merge(quotes.relabel(date = 'quote_date'), 'date', 'quote_date')
+    assert list(res.qty) == [10, 20, 30] and list(res.quote_date) == [1, 5, 5]
+
+
+def test_Dictable_asof_join():
+    trades = Dictable(date = [2, 5, 7, 2, 0], instrument = ['a', 'a', 'a', 'b', 'a'], qty = [10, 20, 30, 40, 50])
+    quotes = Dictable(date = [8, 3, 5, 1, 1], instrument = ['a', 'a', 'a', 'a', 'b'], px = [103, 101, 102, 100, 50])
+    res = trades.asof_join(quotes, 'date', by = 'instrument')
+    assert list(res.qty) == [10, 20, 30, 40] and list(res.px) == [100, 102, 102, 50] and list(res.date) == [2, 5, 7, 2]
+    res = trades.asof_join(quotes, 'date', by = 'instrument', direction = 'forward')
+    assert list(res.qty) == [10, 20, 30, 50] and list(res.px) == [101, 102, 103, 100]
+    res = trades.asof_join(quotes, 'date', by = 'instrument', direction = 'nearest')
+    assert list(res.px) == [100, 102, 103, 50, 100] ## 2 is equally far from 1 and 3 so we go backward
+    res = trades.asof_join(quotes, 'date', by = 'instrument', direction = 'nearest', tolerance = 0)
+    assert list(res.qty) == [20]
+    assert list(trades.asof_join(quotes, 'date').px) == [50, 102, 102, 50]
+    assert len(trades.asof_join(quotes.inc(instrument = 'c'), 'date')) == 0
+    with pytest.raises(ValueError):
+        trades.asof_join(quotes, 'date', direction = 'sideways')
+    assert eq(trades.asof_join(quotes, ['date'], by = 'instrument'), trades.asof_join(quotes, 'date', by = 'instrument'))
+    with pytest.raises(ValueError):
+        trades.asof_join(quotes, ['date', 'instrument'])
+
+
+def test_Dictable_asof_join_dates():
+    trades = Dictable(date = np.array(['2020-01-03', '2020-01-10'], dtype = 'datetime64[D]'), qty = [1, 2])
+    quotes = Dictable(date = np.array(['2020-01-01', '2020-01-09'], dtype = 'datetime64[D]'), px = [100, 101])
+    res = trades.asof_join(quotes, 'date', tolerance = np.timedelta64(1, 'D'))
+    assert list(res.qty) == [2] and list(res.px) == [101]
+
+
+def test_Dictable_between_join():
+    trades = Dictable(date = [2, 5, 9, 4], instrument = ['a', 'a', 'a', 'b'])
+    periods = Dictable(start = [4, 0, 8], end = [8, 4, 9], period = ['q2', 'q1', 'q3'], instrument = 'a')
+    res = trades.between_join(periods, 'date', by = 'instrument')
+    assert list(res.date) == [2, 5, 9] and list(res.period) == ['q1', 'q2', 'q3']
+    res = trades.between_join(periods, 'date')
+    assert list(res.date) == [2, 5, 9, 4, 4] and list(res.period) == ['q1', 'q2', 'q3', 'q1', 'q2']
+    nested = Dictable(start = [0, 3, 4], end = [10, 4, 6], period = ['year', 'x', 'y'])
+    res = trades.between_join(nested, 'date')
+    assert list(res.date) == [2, 5, 5, 9, 4, 4, 4] and list(res.period) == ['year', 'year', 'y', 'year', 'year', 'x', 'y']
+    assert len(trades.between_join(nested, 'date', max_rows = 7)) == 7
+    with pytest.raises(ValueError):
+        trades.between_join(nested, 'date', max_rows = 6)
+    with pytest.raises(ValueError):
+        trades.between_join(periods, 'date', max_rows = 4)
+
+
+def test_Dictable_semi_join_and_xor():
+    lhs = Dictable(a = [1, 2, 3, np.nan, 2], b = ['x', 'y', 'z', 'w', 'v'])
+    rhs = Dictable(a = [2, 2, np.nan, 5], c = range(4))
+    assert list(lhs.isin(rhs)) == [False, True, False, True, True]
+    assert lhs.semi_join(rhs) == lhs.take([1, 3, 4])
+    assert lhs.xor(rhs) == lhs.take([0, 2])
+    assert eq(lhs.right_xor(rhs), Dictable(a = 5, c = 3))
+    assert list(lhs.isin(rhs, lambda a: a + 1, 'a')) == [True, False, False, True, False]
+    lhs = Dictable(a = [1, 1, 2], b = ['x', 'y', 'x'])
+    rhs = Dictable(a = [1.0, 2], b = ['y', 'y'])
+    assert list(lhs.isin(rhs)) == [False, True, False]
+    lists = Dictable(a = [[1,2], [3]]) ## unhashable keys fall back to pair
+    assert list(lists.isin(Dictable(a = [[3], [4,5]]))) == [False, True]
+    assert eq(lists.xor(Dictable(a = [[3], [4,5]])), lists.take([0]))
+
+
+def test_cartesian_pairs():
+    lhs = as_ndarray([np.array([0, 1]), np.array([], dtype = int), np.array([2, 3, 4])])
+    rhs = as_ndarray([np.array([5, 6, 7]), np.array([8]), np.array([9])])
+    lhs_idx, rhs_idx = cartesian_pairs(lhs, rhs)
+    expected = np.concatenate([cartesian(l, r) for l, r in zip(lhs, rhs) if len(l) and len(r)])
+    assert eq(lhs_idx, expected[:,0]) and eq(rhs_idx, expected[:,1])
+    with pytest.raises(ValueError):
+        cartesian_pairs(lhs, rhs, max_rows = 8)
+    lhs_idx, rhs_idx = cartesian_pairs(lhs, rhs, max_rows = 9)
+    assert len(lhs_idx) == 9
+
+
+def test_Dictable_merge_many_to_many_max_rows():
+    lhs = Dictable(a = [1] * 50 + [2], x = range(51))
+    rhs = Dictable(a = [1] * 40 + [2, 3], y = range(42))
+    res = lhs.merge(rhs, 'a')
+    assert len(res) == 50 * 40 + 1
+    assert list(res.x[:3]) == [0, 0, 0] and list(res.y[:3]) == [0, 1, 2]
+    with pytest.raises(ValueError):
+        lhs.merge(rhs, 'a', max_rows = 1000)
+    assert len(lhs.merge(Dictable(a = [3]), 'a')) == 0
+
+
+class Trades(Dictable):
+    _schema = dict(qty = float, date = 'datetime64[D]', name = 'category')
+
+
+def test_Dictable_schema():
+    t = Trades(qty = [1, 2], date = ['2020-01-01', '2020-01-02'], name = 'bond', other = ['a', 'b'])
+    assert t.qty.dtype == np.float64 and t.date.dtype == np.dtype('datetime64[D]') and t.name.dtype == np.dtype('O')
+    assert t.name[0] is t.name[1]
+    assert type(t.take([1])) == Trades and type(t.sort('qty')) == Trades
+    t['qty'] = [3, 4]
+    assert t.qty.dtype == np.float64
+    t['qty'] = 5
+    assert list(t.qty) == [5., 5.] and t.qty.dtype == np.float64
+    with pytest.raises(ValueError):
+        t['date'] = 'not a date'
+    res = t + Trades(qty = 1, other = 'c')
+    assert type(res) == Trades and res.qty.dtype == np.float64 and res.date.dtype == np.dtype('datetime64[D]')
+    assert np.isnat(res.date[-1]) and res.name[-1] is None and list(res.other) == ['a', 'b', 'c']
+    assert Dictable.with_schema(qty = int)(qty = [1.0, 2.0]).qty.dtype == np.dtype(int)
+    assert Dictable(qty = [1, 2]).qty.dtype == np.dtype(int)
+
+
+def test_Dictable_schema_column_named_schema():
+    t = Trades(qty = [1, 2], schema = ['x', 'y'])
+    assert list(t.schema) == ['x', 'y']
+    with pytest.raises(ValueError):
+        Trades(qty = 1, name = [[1], [2]])
+
+
+def test_Dictable_schema_rows_are_not_cast_again():
+    t = Trades(qty = [1, 2, 3], name = ['a', 'b', 'a'])
+    res = t.take([2, 0])
+    assert type(res) == Trades and list(res.qty) == [3., 1.] and res.name[0] is t.name[0]
+    res = t[t.qty > 1]
+    assert type(res) == Trades and list(res.name) == ['b', 'a']
+
+
+def test_Dictable_from_tree_file(tmp_path):
+    import json
+    tree = dict(students = dict(id01 = dict(classes = dict(english = 90, french = 80)), id02 = dict(classes = dict(maths = 70))))
+    path = str(tmp_path / 'school.json')
+    with open(path, 'w') as f:
+        json.dump(tree, f)
+    pattern = 'students/%id/classes/%subject/%grade'
+    assert Dictable.from_tree_file(path, pattern) == Dictable(tree, pattern)
@@ -0,0 +1,33 @@
+import mombai
+import os
+import subprocess
+import sys
+import pytest
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _python(code, *options):
+    path = [_ROOT] + ([os.environ['PYTHONPATH']] if os.environ.get('PYTHONPATH') else [])
+    env = dict(os.environ, PYTHONPATH = os.pathsep.join(path))
+    return subprocess.run([sys.executable] + list(options) + ['-c', code], env = env, capture_output = True, text = True, check = True)
+
+def test_import_mombai_loads_no_submodule():
+    code = "import sys, mombai; print(' '.join(m for m in sys.modules if m.startswith('mombai.')))"
+    assert _python(code).stdout.strip() == ''
+    code = "import sys; from mombai import dt; print(' '.join(sorted(m for m in sys.modules if m.startswith('mombai.'))))"
+    assert 'mombai._graph' not in _python(code).stdout.split()
+
+
+def test_import_mombai_is_lazy():
+    code = "import sys, mombai; print(' '.join(m for m in ['numpy', 'pandas', 'h5py', 'networkx', 'jsonpickle', 'tinydb'] if m in sys.modules))"
+    assert _python(code).stdout.strip() == ''
+    code = "import sys; from mombai import dt, Dict; print(' '.join(m for m in ['pandas', 'h5py', 'networkx', 'jsonpickle', 'tinydb'] if m in sys.modules))"
+    assert _python(code).stdout.strip() == ''
+
+
+def test_lazy_names():
+    for name in mombai.__all__:
+        assert getattr(mombai, name) is getattr(sys.modules[mombai._modules[name]], name)
+    assert set(mombai.__all__) <= set(dir(mombai))
+    with pytest.raises(AttributeError):
+        mombai.not_a_name
@@ -1,7 +1,9 @@
 from mombai._dates import today, dt
-from mombai._periods import day, month, week, bday, Month, BusinessDay, is_eom, is_weekend
+from mombai._periods import day, month, week, bday, Month, BusinessDay, Calendar, as_calendar, as_holiday, schedule, is_eom, is_weekend
 
 import datetime
+import pytest
+import numpy as np
 from dateutil import parser
 D = datetime.datetime
 
@@ -38,3 +40,126 @@ def test_bday():
     assert BusinessDay(convention = 'm').adjust(date) == datetime.datetime(2001,3,30) # Friday previous as Monday following is April
     assert BusinessDay(convention = 'm').adjust(date-week) == datetime.datetime(2001,3,26) # Monday following
 
+
+def test_bday_add_matches_day_by_day_stepping():
+    def step(date, b):
+        date = BusinessDay(convention = 'f').adjust(date)
+        sign = 1 if b>0 else -1
+        for _ in range(abs(b)):
+            date += sign * day
+            while is_weekend(date):
+                date += sign * day
+        return date
+    for i in range(14):
+        date = D(2001,3,1,10,30) + i * day
+        for b in [-12, -5, -1, 0, 1, 4, 5, 23]:
+            assert BusinessDay(b, 'f') + date == step(date, b)
+    assert bday * 2500 + D(2001,1,1) == D(2001,1,1) + 500 * week
+
+
+def test_bday_hols():
+    hols = [D(2001,4,2), D(2001,4,3)]
+    b = BusinessDay(1, hols = hols)
+    assert b.is_holiday(D(2001,4,2))
+    assert not b.is_holiday(D(2001,4,4))
+    assert b + D(2001,3,30) == D(2001,4,4)
+    assert -b + D(2001,4,4) == D(2001,3,30)
+    assert (3*b).calendar is b.calendar
+    assert BusinessDay(convention = 'f', hols = hols).adjust(D(2001,3,31)) == D(2001,4,4)
+    assert BusinessDay(convention = 'm', hols = [D(2001,4,30)]).adjust(D(2001,4,28)) == D(2001,4,27)
+
+
+def test_bday_arrays():
+    dates = np.array(['2001-03-30', '2001-03-31', 'NaT', '2001-04-02'], 'datetime64[D]')
+    res = dates + BusinessDay(1, 'f', hols = Calendar(['2001-04-03']))
+    assert list(res[[0,1,3]]) == [np.datetime64(d) for d in ['2001-04-02', '2001-04-04', '2001-04-04']]
+    assert np.isnat(res[2])
+    objects = np.array([D(2001,3,30,12), None])
+    assert list(objects + bday) == [D(2001,4,2,12), None]
+    assert list(bday.is_holiday(dates)) == [False, True, True, False]
+
+
+def test_calendar_extends_beyond_default_range():
+    assert bday + D(1850,1,4) == D(1850,1,7)
+    assert D(2400,1,3) - bday == D(2399,12,31)
+    assert as_calendar() is as_calendar(None)
+
+
+def test_calendar_conventions():
+    cal = Calendar()
+    date = D(2001,3,31) # a Saturday at the end of the month
+    assert cal.adjust(date, 'Following') == cal.adjust(date, 'f') == D(2001,4,2)
+    assert cal.adjust(date, 'PREVIOUS') == cal.adjust(date, 'm') == D(2001,3,30)
+    with pytest.raises(ValueError):
+        cal.adjust(date, 'x')
+    with pytest.raises(ValueError):
+        cal.add(np.array([date], 'datetime64[D]'), 1, 'nearest')
+
+
+def test_business_day_datetime64_scalars():
+    res = np.datetime64('2001-03-30') + bday
+    assert isinstance(res, np.datetime64) and res == np.datetime64('2001-04-02')
+    assert Calendar().adjust(np.datetime64('2001-03-31')) == np.datetime64('2001-03-30')
+    assert np.isnat(np.datetime64('NaT', 'D') + bday)
+    from mombai._dictable import Dictable
+    d = Dictable(date = np.array(['2001-03-30', '2001-04-02'], 'datetime64[D]'))(nxt = lambda date: date + bday)
+    assert list(d.nxt) == [np.datetime64('2001-04-02'), np.datetime64('2001-04-03')]
+    for value in [5, 'x', np.array([1, 2])]:
+        with pytest.raises(TypeError):
+            bday + value
+
+
+def test_as_holiday():
+    dates = [D(2001,3,29), D(2001,3,30), D(2001,4,2), D(2001,4,2), D(2001,4,4)]
+    hols = as_holiday(dates)
+    assert hols.dtype == np.dtype('datetime64[D]')
+    assert np.datetime64('2001-04-03') in hols and np.datetime64('2001-03-28') in hols
+    assert not np.isin(np.array(dates, 'datetime64[D]'), hols).any()
+    assert np.datetime64('2001-03-31') not in hols # a Saturday is a weekend, not a holiday
+    assert BusinessDay(1, hols = hols) + D(2001,3,30) == D(2001,4,2)
+
+
+def test_month_arrays_match_scalar():
+    dates = [D(2000,1,1) + i * day for i in range(400)]
+    values = np.array(dates, 'datetime64[D]')
+    for m in [-13, -1, 0, 1, 3, 12]:
+        for eom in [False, True]:
+            months = Month(m, eom = eom)
+            assert list(values + months) == [np.datetime64(date + months, 'D') for date in dates]
+            assert list(np.array(dates) + months) == [date + months for date in dates]
+    assert list(values - month) == [np.datetime64(date - month, 'D') for date in dates]
+
+
+def test_month_arrays():
+    dates = np.array(['2001-01-31T12:00', 'NaT'], 'datetime64[m]')
+    res = dates + month
+    assert res.dtype == dates.dtype
+    assert res[0] == np.datetime64('2001-02-28T00:00')
+    assert np.isnat(res[1])
+    assert list(np.array([D(2001,1,31), None]) + month) == [D(2001,2,28), None]
+    res = np.datetime64('2001-01-31') + month
+    assert isinstance(res, np.datetime64) and res == np.datetime64('2001-02-28')
+    for value in [5, 1.5, 'x', np.array([1, 2]), np.array(['2001-01-01'], object)]:
+        with pytest.raises(TypeError):
+            month + value
+
+
+def test_schedule():
+    res = list(schedule(D(2001,1,31), D(2001,7,31), Month(2)))
+    assert len(res) == 1
+    assert list(res[0]) == [D(2001,1,31), D(2001,3,31), D(2001,5,31), D(2001,7,31)]
+    starts = np.array(['2001-02-28', '2001-02-28', 'NaT'], 'datetime64[D]')
+    ends = np.array(['2001-08-31', '2001-01-31', '2001-08-31'], 'datetime64[D]')
+    assert [list(s) for s in schedule(starts, ends, Month(3))] == [[np.datetime64('2001-02-28'), np.datetime64('2001-05-28'), np.datetime64('2001-08-28')], [], []]
+    assert list(next(schedule(starts[:1], ends[:1], Month(3, eom = True)))) == [np.datetime64('2001-02-28'), np.datetime64('2001-05-31'), np.datetime64('2001-08-31')]
+    backwards = next(schedule(D(2011,3,15), D(2010,3,1), -6 * month))
+    assert list(backwards) == [D(2011,3,15), D(2010,9,15), D(2010,3,15)]
+    assert list(next(schedule(D(2001,1,1), D(2001,3,1), 1))) == [D(2001,1,1), D(2001,2,1), D(2001,3,1)]
+    with pytest.raises(ValueError):
+        list(schedule(D(2001,1,1), D(2001,3,1), 0))
+    starts = np.array(['2001-01-15', '1950-01-15', '2001-01-15'], 'datetime64[D]')
+    ends = np.array(['2001-03-15', '2001-01-15', '2001-01-15'], 'datetime64[D]')
+    short, long, single = schedule(starts, ends, month)
+    assert list(schedule(starts[:0], ends[:0], month)) == []
+    assert len(short) == 3 and len(long) == 613 and list(single) == [np.datetime64('2001-01-15')]
+    assert long[-1] == np.datetime64('2001-01-15') and all(np.diff(long.astype('datetime64[M]')).astype(int) == 1)